@@ -1,11 +1,24 @@
-from flask import Flask, render_template, request, redirect, session, jsonify
+from flask import Flask, render_template, request, redirect, session, jsonify, abort, make_response, Response
 from flask_bootstrap import Bootstrap
-from models import db, Consultor, Propaganda, Campanha, OrigemDados, Cota, Meta
+from models import db, Consultor, Propaganda, Campanha, OrigemDados, Cota, Meta, ImagemVariante
+from utils_imagens import gerar_variantes, ImagemInvalida, TAMANHOS_POR_TIPO, TAMANHO_PADRAO
+from utils_cache import StaleWhileRevalidateCache, SharedCacheStore, LeaderLock
+from utils_scheduler import Scheduler
 from dotenv import load_dotenv
 from utils_agendor import (
     fetch_deal_data,
     fetch_deal_meta,
-    fetch_tasks,
+    iter_tasks,
+    count_tasks,
+    reduce_records,
+    Count,
+    SalesAggregator,
+    local_today,
+    sync_deal_store,
+    DEAL_SYNC_INTERVAL,
+    DEAL_RECONCILE_INTERVAL,
+    AGENDOR_CLIENT,
+    PRIORITY_BACKGROUND,
     params_ganhos,
     params_prospeccao,
     params_quentes,
@@ -15,23 +28,54 @@ from utils_agendor import (
     meses
 )
 from dateutil import parser
-from collections import defaultdict
-from datetime import datetime, time, date, timedelta, timezone
+from collections import OrderedDict
+from datetime import datetime, time, date, timedelta
 from time import monotonic
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from types import MappingProxyType
 from flask import flash, has_app_context
 from sqlalchemy import func, or_
-import os, base64, calendar, unicodedata, hashlib, json, threading
+import os, base64, calendar, unicodedata, hashlib, json, threading, queue, tempfile
+import click
 
-EXCLUDED_CONSULTOR_IDS = {'640301'}
 EXCLUDED_COTA_CONSULTORES = {2}
-
-_dashboard_cache = {'dados': None, 'last_update': None}
-_dashboard_cache_lock = threading.Lock()
-_dashboard_stop_event = threading.Event()
-_dashboard_thread = None
-_ultima_venda_cache = {'ultima': None, 'last_check': 0.0}
-_ultima_venda_cache_lock = threading.Lock()
-_ultima_venda_cache_ttl = 30.0
+# Tipos de tarefa contados no dashboard, ja normalizados. O filtro `type` da
+# API pede o nome exato cadastrado no Agendor: os nomes sao descobertos na
+# contagem paginada e os totais por filtro sao conferidos contra ela.
+TIPOS_TAREFA_CONTADOS = {'visitas': 'VISITA', 'reunioes': 'REUNIAO'}
+TIPOS_TAREFA_REVALIDAR = float(os.getenv('TIPOS_TAREFA_REVALIDAR', str(6 * 3600)))
+
+VENDAS_WATCH_INTERVAL = float(os.getenv('VENDAS_WATCH_INTERVAL', '30'))
+SSE_HEARTBEAT = 15.0
+# Cada painel conectado ocupa uma thread do worker (gunicorn.conf.py usa
+# gthread). As conexoes sao encerradas depois de SSE_DURACAO_MAX segundos e o
+# EventSource reconecta sozinho; acima de SSE_MAX_CONEXOES por processo o
+# stream e recusado, para sobrar thread para as paginas e a API.
+SSE_DURACAO_MAX = float(os.getenv('SSE_DURACAO_MAX', '300'))
+SSE_MAX_CONEXOES = int(os.getenv('SSE_MAX_CONEXOES', '8'))
+# Cotas e meta vem do Postgres e sao baratas; as contagens de tarefas pagam
+# paginas do Agendor e tem intervalo proprio (TAREFAS_INTERVAL).
+DASHBOARD_CACHE_TTL = float(os.getenv('DASHBOARD_CACHE_TTL', '120'))
+TAREFAS_INTERVAL = float(os.getenv('TAREFAS_INTERVAL', '600'))
+DASHBOARD_CACHE_STALE = float(os.getenv('DASHBOARD_CACHE_STALE', '3600'))
+DASHBOARD_HISTORICO = 10
+# Com varios workers, so o lider (flock) consulta o Agendor e publica em
+# dev.cache_compartilhado; os demais releem a tabela a cada CACHE_LOCAL_TTL.
+CACHE_LOCAL_TTL = float(os.getenv('CACHE_LOCAL_TTL', '15'))
+LIDER_LOCK_PATH = os.getenv('PAINEL_LIDER_LOCK', os.path.join(tempfile.gettempdir(), 'painel_reobote_lider.lock'))
+LIDER_VERIFICACAO = 60.0
+ANALYTICS_CACHE_TTL = float(os.getenv('ANALYTICS_CACHE_TTL', '60'))
+ANALYTICS_CACHE_STALE = float(os.getenv('ANALYTICS_CACHE_STALE', '3600'))
+# Fontes independentes (Agendor e Postgres) de um mesmo painel rodam juntas.
+FONTES_PARALELAS = int(os.getenv('FONTES_PARALELAS', '4'))
+_dashboard_historico = OrderedDict()
+_dashboard_historico_lock = threading.Lock()
+_agregado_vendas_cache = {'snapshot': None, 'dia': None, 'agregado': None}
+_agregado_vendas_lock = threading.Lock()
+_tipos_tarefa_api = {'nomes': None, 'conferido_em': 0.0, 'paginado': None}
+_tipos_tarefa_lock = threading.Lock()
 
 load_dotenv()
 
@@ -47,6 +91,77 @@ app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
 Bootstrap(app)
 db.init_app(app)
 
+
+def criar_tabelas():
+    """Cria as tabelas que ainda nao existem (imagens_variantes, espelho de
+    negocios, cache compartilhado...).
+
+    Nao roda no import: `python app.py` chama direto, o gunicorn chama uma vez
+    no master (on_starting, via `flask criar-tabelas`) antes dos workers.
+    """
+    try:
+        with app.app_context():
+            db.create_all()
+        return True
+    except Exception as e:
+        print(f"⚠️ Não foi possível criar/verificar tabelas: {e}")
+        return False
+
+
+@contextmanager
+def contexto_segundo_plano():
+    """App context e prioridade de background para recomputos fora de requests."""
+    with app.app_context(), AGENDOR_CLIENT.priority(PRIORITY_BACKGROUND):
+        yield
+
+
+_executor_fontes = ThreadPoolExecutor(max_workers=FONTES_PARALELAS, thread_name_prefix='fontes')
+
+
+def buscar_em_paralelo(**fontes):
+    """Executa fontes independentes ao mesmo tempo e devolve {nome: resultado}.
+
+    Cada fonte roda com o proprio app context (sessao de banco separada) e a
+    prioridade de Agendor de quem chamou; a primeira falha e propagada. As
+    fontes devem devolver valores simples, nao objetos ligados a sessao.
+    """
+    prioridade = AGENDOR_CLIENT.current_priority
+
+    def executar(fonte):
+        with app.app_context(), AGENDOR_CLIENT.priority(prioridade):
+            return fonte()
+
+    futuros = {nome: _executor_fontes.submit(executar, fonte) for nome, fonte in fontes.items()}
+    return {nome: futuro.result() for nome, futuro in futuros.items()}
+
+
+_cache_compartilhado = SharedCacheStore()
+_lider = LeaderLock(LIDER_LOCK_PATH)
+_dashboard_cache = StaleWhileRevalidateCache(
+    ttl=CACHE_LOCAL_TTL,
+    stale_ttl=DASHBOARD_CACHE_STALE,
+    name='dashboard',
+    context=contexto_segundo_plano
+)
+_analytics_cache = StaleWhileRevalidateCache(
+    ttl=CACHE_LOCAL_TTL,
+    stale_ttl=ANALYTICS_CACHE_STALE,
+    name='analytics',
+    context=contexto_segundo_plano
+)
+_tarefas_cache = StaleWhileRevalidateCache(
+    ttl=TAREFAS_INTERVAL,
+    stale_ttl=TAREFAS_INTERVAL * 6,
+    name='tarefas',
+    context=contexto_segundo_plano
+)
+_ultima_venda_cache = StaleWhileRevalidateCache(
+    ttl=30.0,
+    stale_ttl=300.0,
+    name='ultima-venda',
+    context=contexto_segundo_plano
+)
+
 @app.context_processor
 def inject_current_year():
     return {'current_year': datetime.now().year}
@@ -60,29 +175,6 @@ def format_valor(valor):
 app.jinja_env.filters['format_valor'] = format_valor
 
 
-def parse_dt_safe(s):
-    if not s or (isinstance(s, str) and not s.strip()):
-        return None
-    try:
-        from dateutil import parser as _p
-        return _p.parse(s)
-    except Exception:
-        return None
-
-
-def data_negocio(negocio):
-    if not negocio:
-        return None
-    return parse_dt_safe(negocio.get('Data Ganho') or negocio.get('Data Final') or negocio.get('endTime') or negocio.get('end_time'))
-
-
-def negocio_excluido(negocio):
-    if not negocio:
-        return False
-    consultor_id = negocio.get('ConsultorId')
-    return consultor_id is not None and str(consultor_id) in EXCLUDED_CONSULTOR_IDS
-
-
 def data_no_intervalo(data_ref, inicio, fim):
     if not data_ref:
         return False
@@ -116,6 +208,222 @@ def normalize_task_type(tipo):
     return normalized.strip().upper()
 
 
+# Imagens servidas como binario. Uploads sao convertidos em variantes de
+# tamanho fixo (utils_imagens), e a versao (ETag) gravada junto com elas e o
+# que listas e paineis usam para montar URLs versionadas. Registros antigos,
+# que so tem o original em imagem_base64, aparecem depois de convertidos pela
+# tarefa 'converter-imagens' (ou `flask converter-imagens`).
+IMAGEM_MODELOS = {'consultor': Consultor, 'propaganda': Propaganda}
+IMAGEM_CACHE_MAX = 64
+IMAGEM_CACHE_CONTROL_VERSIONADA = 'public, max-age=31536000, immutable'
+IMAGEM_CACHE_CONTROL_PADRAO = 'public, no-cache'
+
+_imagens_cache = OrderedDict()
+_imagens_cache_lock = threading.Lock()
+
+
+def versao_imagem_sql(modelo):
+    tipo = next(t for t, m in IMAGEM_MODELOS.items() if m is modelo)
+    versao_variante = (
+        db.select(ImagemVariante.versao)
+        .where(ImagemVariante.dono_tipo == tipo, ImagemVariante.dono_id == modelo.id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    return versao_variante.label('imagem_versao')
+
+
+def url_imagem(tipo, obj_id, versao=None, tamanho=None):
+    if not versao:
+        return None
+    url = f"/img/{tipo}/{obj_id}?v={versao[:12]}"
+    if tamanho and tamanho != TAMANHO_PADRAO[tipo]:
+        url += f"&tam={tamanho}"
+    return url
+
+
+app.jinja_env.globals['url_imagem'] = url_imagem
+
+
+def _guardar_imagem_cache(chave, imagem):
+    with _imagens_cache_lock:
+        _imagens_cache[chave] = imagem
+        while len(_imagens_cache) > IMAGEM_CACHE_MAX:
+            _imagens_cache.popitem(last=False)
+    return imagem
+
+
+def _carregar_imagem(tipo, obj_id, tamanho, versao, mimetype):
+    chave = (tipo, obj_id, tamanho, versao)
+    with _imagens_cache_lock:
+        if chave in _imagens_cache:
+            _imagens_cache.move_to_end(chave)
+            return _imagens_cache[chave]
+
+    dados = db.session.query(ImagemVariante.conteudo).filter_by(
+        dono_tipo=tipo, dono_id=obj_id, tamanho=tamanho
+    ).scalar()
+    if dados is None:
+        return None
+    return _guardar_imagem_cache(chave, (dados, mimetype))
+
+
+def servir_imagem(tipo, obj_id):
+    tamanho = request.args.get('tam') or TAMANHO_PADRAO[tipo]
+    if tamanho not in TAMANHOS_POR_TIPO[tipo]:
+        abort(404)
+
+    variante = db.session.query(ImagemVariante.versao, ImagemVariante.mimetype).filter_by(
+        dono_tipo=tipo, dono_id=obj_id, tamanho=tamanho
+    ).first()
+    if variante is None:
+        abort(404)
+    versao, mimetype = variante
+    etag = f"{versao}-{tamanho}"
+
+    versionada = request.args.get('v') == versao[:12]
+    cache_control = IMAGEM_CACHE_CONTROL_VERSIONADA if versionada else IMAGEM_CACHE_CONTROL_PADRAO
+
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        imagem = _carregar_imagem(tipo, obj_id, tamanho, versao, mimetype)
+        if imagem is None:
+            abort(404)
+        dados, mimetype = imagem
+        response = make_response(dados)
+        response.headers['Content-Type'] = mimetype
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def ler_upload_imagem(tipo, arquivo):
+    """Converte o arquivo enviado nas variantes do tipo; None se nao houver arquivo."""
+    if not arquivo or arquivo.filename == '':
+        return None
+    return gerar_variantes(arquivo.read(), TAMANHOS_POR_TIPO[tipo])
+
+
+def remover_variantes(tipo, dono_id):
+    ImagemVariante.query.filter_by(dono_tipo=tipo, dono_id=dono_id).delete(synchronize_session=False)
+
+
+def salvar_variantes(tipo, dono_id, variantes):
+    remover_variantes(tipo, dono_id)
+    for variante in variantes:
+        db.session.add(ImagemVariante(
+            dono_tipo=tipo,
+            dono_id=dono_id,
+            tamanho=variante.tamanho,
+            mimetype=variante.mimetype,
+            largura=variante.largura,
+            altura=variante.altura,
+            versao=variante.versao,
+            conteudo=variante.conteudo
+        ))
+
+
+ADMIN_PAGINA = 24
+
+
+def paginar_por_id(consulta, coluna_id, apos=None, decrescente=False, limite=ADMIN_PAGINA):
+    """Paginacao por chave (keyset): devolve (itens, cursor da proxima pagina).
+
+    Filtra pelo ultimo id visto em vez de usar OFFSET, entao cada pagina custa
+    o mesmo independentemente de quantos registros existam antes dela.
+    """
+    if apos is not None:
+        consulta = consulta.filter(coluna_id < apos if decrescente else coluna_id > apos)
+    consulta = consulta.order_by(coluna_id.desc() if decrescente else coluna_id.asc())
+    itens = consulta.limit(limite + 1).all()
+    proximo = itens[limite - 1].id if len(itens) > limite else None
+    return itens[:limite], proximo
+
+
+def normalizar_nome(nome):
+    return ' '.join(normalize_task_type(nome).split())
+
+
+class ConsultorResumo:
+    __slots__ = ('id', 'nome', 'id_agendor', 'ativo', 'imagem_versao')
+
+    def __init__(self, consultor):
+        self.id = consultor.id
+        self.nome = consultor.nome
+        self.id_agendor = consultor.id_agendor
+        self.ativo = consultor.ativo
+        self.imagem_versao = consultor.imagem_versao
+
+    @property
+    def imagem_url(self):
+        return url_imagem('consultor', self.id, self.imagem_versao)
+
+
+class DiretorioConsultores:
+    """Indice em memoria dos consultores por id, id_agendor e nome normalizado.
+
+    Carrega a tabela inteira numa unica consulta e fica valido ate ser
+    invalidado pelas rotas de cadastro (ou ate `ttl` segundos, para que outros
+    processos tambem enxerguem as alteracoes).
+    """
+
+    def __init__(self, ttl=300.0):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._indices = None
+        self._carregado_em = 0.0
+
+    def invalidar(self):
+        with self._lock:
+            self._indices = None
+
+    def carregar(self):
+        self._obter_indices()
+
+    def _obter_indices(self):
+        with self._lock:
+            if self._indices is not None and monotonic() - self._carregado_em < self._ttl:
+                return self._indices
+            por_id, por_agendor, por_nome = {}, {}, {}
+            consultores = db.session.query(
+                Consultor.id,
+                Consultor.nome,
+                Consultor.id_agendor,
+                Consultor.ativo,
+                versao_imagem_sql(Consultor)
+            )
+            for consultor in consultores:
+                resumo = ConsultorResumo(consultor)
+                por_id[resumo.id] = resumo
+                if resumo.id_agendor:
+                    por_agendor.setdefault(str(resumo.id_agendor).strip(), resumo)
+                if resumo.nome:
+                    por_nome.setdefault(normalizar_nome(resumo.nome), resumo)
+            self._indices = (por_id, por_agendor, por_nome)
+            self._carregado_em = monotonic()
+            return self._indices
+
+    def por_id(self, consultor_id):
+        return self._obter_indices()[0].get(consultor_id)
+
+    def por_id_agendor(self, id_agendor):
+        if id_agendor is None:
+            return None
+        return self._obter_indices()[1].get(str(id_agendor).strip())
+
+    def por_nome(self, nome):
+        if not nome:
+            return None
+        return self._obter_indices()[2].get(normalizar_nome(nome))
+
+    def buscar(self, id_agendor=None, nome=None):
+        return self.por_id_agendor(id_agendor) or self.por_nome(nome)
+
+
+diretorio_consultores = DiretorioConsultores()
+
+
 def ensure_datetime(value, end=False):
     if value is None:
         return None
@@ -178,7 +486,21 @@ def obter_meta_vigente(inicio=None, fim=None):
         return float(meta.valor)
     return None
 
-def calcular_progresso_campanha():
+def obter_agregado_vendas():
+    """Agregado de vendas do snapshot atual de ganhos, recalculado apenas quando o snapshot muda."""
+    ganhos = fetch_deal_data(params_ganhos)
+    hoje = local_today()
+    with _agregado_vendas_lock:
+        if _agregado_vendas_cache['snapshot'] is ganhos and _agregado_vendas_cache['dia'] == hoje:
+            return _agregado_vendas_cache['agregado']
+
+    agregado = SalesAggregator(ganhos, hoje)
+    with _agregado_vendas_lock:
+        _agregado_vendas_cache.update(snapshot=ganhos, dia=hoje, agregado=agregado)
+    return agregado
+
+
+def calcular_progresso_campanha(agregado=None):
     campanha = Campanha.query.first()
     if not campanha:
         return 0, '', 'secondary', None, None
@@ -200,13 +522,8 @@ def calcular_progresso_campanha():
     ano_atual = datetime.now().year
 
     if origem.value.strip().upper() == 'AGENDOR':
-        ganhos = fetch_deal_data(params_ganhos)
-        ganhos_periodo = []
-        for g in ganhos:
-            data_ref = data_negocio(g)
-            if data_ref and inicio <= data_ref.date() <= fim:
-                ganhos_periodo.append(g)
-        valor_total = sum(g['Valor do Negócio'] for g in ganhos_periodo)
+        agregado = agregado or obter_agregado_vendas()
+        valor_total = agregado.total_periodo(inicio, fim)
 
     elif origem.value.strip().upper() == 'COTAS':
         inicio_dt = ensure_datetime(inicio)
@@ -240,13 +557,7 @@ def home():
         return redirect('/')
     return render_template('home.html')
 
-def update_progress(ganhos, mes_atual, ano_atual):
-    df_mes_atual = []
-    for g in ganhos:
-        data_ref = data_negocio(g)
-        if data_ref and data_ref.month == mes_atual and data_ref.year == ano_atual:
-            df_mes_atual.append(g)
-    valor_total_mes_atual = sum(g['Valor do Negócio'] for g in df_mes_atual)
+def update_progress(valor_total_mes_atual, mes_atual, ano_atual):
     ultimo_dia = calendar.monthrange(ano_atual, mes_atual)[1]
     inicio_mes = date(ano_atual, mes_atual, 1)
     fim_mes = date(ano_atual, mes_atual, ultimo_dia)
@@ -258,23 +569,16 @@ def update_progress(ganhos, mes_atual, ano_atual):
 
 
 def obter_negocios_ganhos_mes():
-    hoje = datetime.now()
-    inicio_mes = date(hoje.year, hoje.month, 1)
-    params_mes = dict(params_ganhos, since=inicio_mes.strftime('%Y-%m-%d'))
-    ganhos = fetch_deal_data(params_mes)
     negocios = []
-    for registro in ganhos:
-        data_ganho = data_negocio(registro)
-        if not data_ganho or data_ganho.year != hoje.year or data_ganho.month != hoje.month:
-            continue
+    for registro in obter_agregado_vendas().negocios_mes:
         negocios.append({
-            'id': registro.get('ID'),
-            'consultor': registro.get('Consultor'),
-            'valor': float(registro.get('Valor do Negócio') or 0),
-            'data_ganho': data_ganho.strftime('%Y-%m-%d %H:%M:%S') if isinstance(data_ganho, datetime) else str(data_ganho),
-            'status': registro.get('Status'),
-            'etapa': registro.get('Etapa'),
-            'funil': registro.get('Funil'),
+            'id': registro.id,
+            'consultor': registro.consultor,
+            'valor': registro.valor,
+            'data_ganho': registro.data_ganho.strftime('%Y-%m-%d %H:%M:%S'),
+            'status': registro.status,
+            'etapa': registro.etapa,
+            'funil': registro.funil,
         })
     return negocios
 
@@ -283,114 +587,194 @@ def listar_negocios_ganhos():
     ganhos = fetch_deal_data(params_ganhos)
     negocios = []
     for registro in ganhos:
-        nome_negocio = registro.get('Nome') or registro.get('Etapa') or registro.get('Status') or registro.get('ID')
-        ganho_dt = data_negocio(registro)
+        nome_negocio = registro.nome or registro.etapa or registro.status or registro.id
+        ganho_dt = registro.data_ganho
         negocios.append({
-            'id': registro.get('ID'),
+            'id': registro.id,
             'nome': nome_negocio,
-            'consultor': registro.get('Consultor'),
-            'valor': float(registro.get('Valor do Negócio') or 0),
-            'status': registro.get('Status'),
+            'consultor': registro.consultor,
+            'valor': registro.valor,
+            'status': registro.status,
             'data_ganho': ganho_dt.strftime('%Y-%m-%d %H:%M:%S') if ganho_dt else None,
         })
     return negocios
 
 
 def agrupar_negocios_ganhos_por_consultor():
-    hoje = datetime.now()
-    inicio_mes = date(hoje.year, hoje.month, 1)
-    params_mes = dict(params_ganhos, since=inicio_mes.strftime('%Y-%m-%d'))
-    ganhos = fetch_deal_data(params_mes)
-    consultores = {}
-
-    for registro in ganhos:
-        data_ganho = data_negocio(registro)
-        if not data_ganho or data_ganho.year != hoje.year or data_ganho.month != hoje.month:
-            continue
-        consultor_nome = registro.get('Consultor') or 'Sem consultor'
-        valor = float(registro.get('Valor do Negócio') or 0)
-        nome_negocio = registro.get('Nome') or registro.get('Etapa') or f"Negócio #{registro.get('ID')}"
-
-        registro_bounded = {
-            'nome': nome_negocio,
-            'valor': valor,
-            'data_ganho': data_ganho.strftime('%Y-%m-%d %H:%M:%S')
-        }
-
-        entry = consultores.setdefault(consultor_nome, {
-            'consultor': consultor_nome,
-            'total': 0.0,
-            'negocios': []
+    consultores = []
+    for entry in obter_agregado_vendas().ranking():
+        consultores.append({
+            'consultor': entry['nome'] or 'Sem consultor',
+            'total': entry['total'],
+            'negocios': [
+                {
+                    'nome': registro.nome or registro.etapa or f"Negócio #{registro.id}",
+                    'valor': registro.valor,
+                    'data_ganho': registro.data_ganho.strftime('%Y-%m-%d %H:%M:%S')
+                }
+                for registro in entry['negocios']
+            ]
         })
-        entry['total'] += valor
-        entry['negocios'].append(registro_bounded)
-
-    for entry in consultores.values():
-        entry['negocios'].sort(key=lambda d: d['valor'], reverse=True)
-
-    return sorted(consultores.values(), key=lambda c: c['total'], reverse=True)
+    return consultores
 
 
-def obter_dashboard_tarefas_dados():
+def periodo_mes_atual():
     hoje = datetime.now().date()
-    inicio_mes = hoje.replace(day=1)
     ultimo_dia = calendar.monthrange(hoje.year, hoje.month)[1]
-    fim_mes = date(hoje.year, hoje.month, ultimo_dia)
-    inicio_mes_dt = ensure_datetime(inicio_mes)
-    fim_mes_dt = ensure_datetime(fim_mes, end=True)
+    return hoje.replace(day=1), date(hoje.year, hoje.month, ultimo_dia)
+
+
+def contar_tarefas_mes(inicio_mes, fim_mes):
+    """Tarefas concluidas no periodo: total, visitas e reunioes.
 
+    Com os nomes dos tipos ja descobertos, cada numero sai do totalCount de
+    uma consulta por filtro; senao, ou se os totais nao baterem com a ultima
+    paginacao, as tarefas sao paginadas (o que descobre os nomes de novo).
+    """
     due_inicio = datetime.combine(inicio_mes, time.min).strftime('%Y-%m-%dT%H:%M:%SZ')
     due_fim = datetime.combine(fim_mes + timedelta(days=1), time.min).strftime('%Y-%m-%dT%H:%M:%SZ')
     params_tarefas = {
-        'per_page': 100,
         'finishedDateGt': due_inicio,
         'finishedDateLt': due_fim
     }
-    tarefas = fetch_tasks(params_tarefas)
 
-    total_visitas = 0
-    total_reunioes = 0
-    for tarefa in tarefas:
+    with _tipos_tarefa_lock:
+        nomes = _tipos_tarefa_api['nomes']
+        paginado = _tipos_tarefa_api['paginado']
+        if monotonic() - _tipos_tarefa_api['conferido_em'] > TIPOS_TAREFA_REVALIDAR:
+            nomes = None
+    if nomes is not None:
+        contagem = contar_tarefas_por_total(params_tarefas, nomes)
+        if contagem is not None and not difere_da_paginacao(contagem, paginado, params_tarefas):
+            return contagem
+        print("⚠️ Totais de tarefas do Agendor nao conferem; contando pagina a pagina.")
+    return contar_tarefas_paginando(params_tarefas, inicio_mes, fim_mes)
+
+
+def contar_tarefas_por_total(params_tarefas, nomes):
+    """Soma o totalCount de cada nome de tipo; None se algum total faltar ou parecer errado.
+
+    Tipo sem nome conhecido (nenhuma tarefa dele na ultima paginacao) conta 0
+    sem consultar a API.
+    """
+    contagem = {'total': count_tasks(params_tarefas)}
+    for chave in TIPOS_TAREFA_CONTADOS:
+        totais = [count_tasks({**params_tarefas, 'type': nome}) for nome in sorted(nomes[chave])]
+        contagem[chave] = None if None in totais else sum(totais)
+    if None in contagem.values():
+        return None
+    if sum(contagem[chave] for chave in TIPOS_TAREFA_CONTADOS) > contagem['total']:
+        return None
+    return contagem
+
+
+def difere_da_paginacao(contagem, paginado, params_tarefas):
+    """Confere os totais por tipo contra a ultima paginacao do mesmo periodo.
+
+    So da para comparar enquanto o total nao mudou; com o total igual e nao
+    zero, um tipo diferente indica nome trocado no Agendor.
+    """
+    if paginado is None or paginado[0] != params_tarefas:
+        return False
+    esperado = paginado[1]
+    if not contagem['total'] or contagem['total'] != esperado['total']:
+        return False
+    return any(contagem[chave] != esperado[chave] for chave in TIPOS_TAREFA_CONTADOS)
+
+
+def contar_tarefas_paginando(params_tarefas, inicio_mes, fim_mes):
+    nomes = {chave: set() for chave in TIPOS_TAREFA_CONTADOS}
+
+    def tarefas():
+        # Guarda os nomes crus que normalizam para cada tipo contado.
+        for tarefa in iter_tasks({**params_tarefas, 'per_page': 100}):
+            tipo = normalize_task_type(tarefa.tipo)
+            for chave, normalizado in TIPOS_TAREFA_CONTADOS.items():
+                if tipo == normalizado:
+                    nomes[chave].add(tarefa.tipo)
+            yield tarefa
+
+    def tipo_concluida_no_mes(tarefa):
         # Contabiliza apenas tarefas concluídas no período
-        if not tarefa.get('Concluida'):
-            continue
-
-        data_finalizacao = parse_dt_safe(tarefa.get('FinalizadaEm') or tarefa.get('Data'))
-        if not data_finalizacao:
-            continue
-        if not data_no_intervalo(data_finalizacao, inicio_mes, fim_mes):
-            continue
-
-        tipo = normalize_task_type(tarefa.get('Tipo'))
-        if tipo == 'VISITA':
-            total_visitas += 1
-        elif tipo == 'REUNIAO':
-            total_reunioes += 1
-
-    params_deals = dict(params_ganhos)
-    params_deals['since'] = inicio_mes.isoformat()
-    ganhos = fetch_deal_data(params_deals)
-    ganhos_mes = []
-    for g in ganhos:
-        if data_no_intervalo(data_negocio(g), inicio_mes, fim_mes):
-            ganhos_mes.append(g)
-
-    meta_periodo = obter_meta_vigente(inicio_mes, fim_mes) or 0
+        if not tarefa.concluida:
+            return None
+        if not data_no_intervalo(tarefa.finalizada_em or tarefa.data, inicio_mes, fim_mes):
+            return None
+        return normalize_task_type(tarefa.tipo)
+
+    redutores = {'total': Count()}
+    for chave, normalizado in TIPOS_TAREFA_CONTADOS.items():
+        redutores[chave] = Count(where=lambda t, n=normalizado: tipo_concluida_no_mes(t) == n)
+        # Mesmo criterio do filtro `type` da API, para conferir os nomes.
+        redutores[f'{chave}_api'] = Count(where=lambda t, n=normalizado: normalize_task_type(t.tipo) == n)
+    resultado = reduce_records(tarefas(), **redutores)
+
+    # Os nomes vistos (inclusive nenhum) passam a valer para o totalCount; a
+    # contagem paginada fica de referencia para a proxima consulta por total.
+    esperado = {'total': resultado['total']}
+    esperado.update({chave: resultado[f'{chave}_api'] for chave in TIPOS_TAREFA_CONTADOS})
+    with _tipos_tarefa_lock:
+        _tipos_tarefa_api.update(
+            nomes=nomes, conferido_em=monotonic(), paginado=(dict(params_tarefas), esperado)
+        )
+
+    return {'total': resultado['total'], **{chave: resultado[chave] for chave in TIPOS_TAREFA_CONTADOS}}
+
+
+def _chave_tarefas(inicio_mes):
+    return inicio_mes.strftime('%Y-%m')
+
+
+def obter_contagem_tarefas(inicio_mes, fim_mes):
+    # Renovada pela tarefa 'contagem-tarefas' do agendador; aqui so le.
+    return _tarefas_cache.get(_chave_tarefas(inicio_mes), lambda: contar_tarefas_mes(inicio_mes, fim_mes))
+
+
+def obter_dashboard_tarefas_dados():
+    inicio_mes, fim_mes = periodo_mes_atual()
+    inicio_mes_dt = ensure_datetime(inicio_mes)
+    fim_mes_dt = ensure_datetime(fim_mes, end=True)
+
+    fontes = buscar_em_paralelo(
+        tarefas=lambda: obter_contagem_tarefas(inicio_mes, fim_mes),
+        negocios=lambda: len(obter_agregado_vendas().negocios_mes),
+        meta=lambda: obter_meta_vigente(inicio_mes, fim_mes),
+        # Uma unica consulta por (semana, consultor) alimenta a serie semanal e o ranking.
+        cotas=lambda: Cota.somar_por_periodo(
+            'week',
+            inicio=inicio_mes_dt,
+            fim=fim_mes_dt,
+            campo='valor',
+            agrupar_por='consultor_id',
+            excluir_consultores=EXCLUDED_COTA_CONSULTORES
+        ),
+        consultores=diretorio_consultores.carregar,
+    )
+    contagem_tarefas = fontes['tarefas']
+    total_visitas = contagem_tarefas['visitas']
+    total_reunioes = contagem_tarefas['reunioes']
+
+    negocios_ganhos_mes = fontes['negocios']
+
+    meta_periodo = fontes['meta'] or 0
     semanas = gerar_semanas_periodo(inicio_mes, fim_mes)
     meta_por_semana = meta_periodo / len(semanas) if semanas and meta_periodo else 0
+    linhas_cotas = fontes['cotas']
+    total_por_semana = {}
+    total_por_consultor = {}
+    for linha in linhas_cotas:
+        inicio_balde = ensure_date(linha.balde)
+        total = float(linha.total or 0)
+        total_por_semana[inicio_balde] = total_por_semana.get(inicio_balde, 0.0) + total
+        total_por_consultor[linha.grupo] = total_por_consultor.get(linha.grupo, 0.0) + total
+
     serie_semanal = []
     acumulado_real = 0
     acumulado_meta = 0
     total_liquido = 0
     for semana in semanas:
-        inicio_semana_dt = ensure_datetime(semana['inicio'])
-        fim_semana_dt = ensure_datetime(semana['fim'], end=True)
-        valor_semana = total_cotas(
-            inicio=inicio_semana_dt,
-            fim=fim_semana_dt,
-            campo='valor',
-            exclude_consultores=EXCLUDED_COTA_CONSULTORES
-        )
+        segunda = semana['inicio'] - timedelta(days=semana['inicio'].weekday())
+        valor_semana = total_por_semana.get(segunda, 0.0)
         total_liquido += valor_semana
         acumulado_real += valor_semana
         acumulado_meta += meta_por_semana
@@ -400,210 +784,397 @@ def obter_dashboard_tarefas_dados():
             'meta': round(acumulado_meta, 2)
         })
 
-    ranking_query = (
-        db.session.query(
-            Cota.consultor_id,
-            func.coalesce(func.sum(Cota.valor), 0).label('total')
-        )
-        .filter(Cota.data_aquisicao >= inicio_mes_dt)
-        .filter(Cota.data_aquisicao <= fim_mes_dt)
-    )
-    if EXCLUDED_COTA_CONSULTORES:
-        ranking_query = ranking_query.filter(~Cota.consultor_id.in_(tuple(EXCLUDED_COTA_CONSULTORES)))
-    ranking_raw = ranking_query.group_by(Cota.consultor_id).all()
-    consultor_ids = [row.consultor_id for row in ranking_raw if row.consultor_id]
-    consultores = {}
-    if consultor_ids:
-        consultores = {c.id: c for c in Consultor.query.filter(Consultor.id.in_(consultor_ids)).all()}
-
     ranking = []
-    for pos, row in enumerate(sorted(ranking_raw, key=lambda r: float(r.total or 0), reverse=True), start=1):
-        if row.consultor_id is None:
+    ranking_ordenado = sorted(total_por_consultor.items(), key=lambda item: item[1], reverse=True)
+    for pos, (consultor_id, total) in enumerate(ranking_ordenado, start=1):
+        if consultor_id is None:
             nome = 'Sem consultor'
-            imagem = None
+            imagem_url = None
         else:
-            consultor = consultores.get(row.consultor_id)
-            nome = consultor.nome if consultor else f'Consultor #{row.consultor_id}'
-            imagem = consultor.imagem_base64 if consultor and consultor.imagem_base64 else None
+            consultor = diretorio_consultores.por_id(consultor_id)
+            nome = consultor.nome if consultor else f'Consultor #{consultor_id}'
+            imagem_url = consultor.imagem_url if consultor else None
         ranking.append({
             'posicao': pos,
             'nome': nome,
-            'valor': float(row.total or 0),
-            'imagem': imagem
+            'valor': total,
+            'imagem_url': imagem_url
         })
 
     dados = {
         'periodo_label': f"{inicio_mes.strftime('%d/%m/%Y')} - {fim_mes.strftime('%d/%m/%Y')}",
         'total_visitas': total_visitas,
         'total_reunioes': total_reunioes,
-        'negocios_ganhos': len(ganhos_mes),
+        'negocios_ganhos': negocios_ganhos_mes,
         'meta_periodo': round(meta_periodo, 2),
         'valor_total_liquido': round(total_liquido, 2),
         'serie_semanal': serie_semanal,
         'ranking': ranking,
-        'total_tarefas': len(tarefas),
-        'last_updated': datetime.now().isoformat()
+        'total_tarefas': contagem_tarefas['total'],
     }
+    # A assinatura (ETag) cobre so os dados: um recomputo sem mudancas mantem
+    # a versao e os paineis seguem recebendo 304.
     dados['signature'] = hashlib.md5(json.dumps(dados, sort_keys=True, default=str).encode()).hexdigest()
+    dados['last_updated'] = datetime.now().isoformat()
     return dados
 
 
-def atualizar_cache_dashboard():
-    ctx = None
-    if not has_app_context():
-        ctx = app.app_context()
-        ctx.push()
-    try:
-        dados = obter_dashboard_tarefas_dados()
-        with _dashboard_cache_lock:
-            _dashboard_cache['dados'] = dados
-            _dashboard_cache['last_update'] = datetime.now(timezone.utc).isoformat()
-    except Exception as e:
-        print(f"⚠️ Falha ao atualizar cache do dashboard: {e}")
-    finally:
-        if ctx is not None:
-            ctx.pop()
+def publicar_compartilhado(chave, valor):
+    _cache_compartilhado.write(chave, valor)
+    return valor
+
+
+def carregar_compartilhado(chave, calcular, idade_max):
+    """Usa o valor publicado pelo lider.
+
+    So calcula (e publica) quem e ou assume o lider, ou um processo que ainda
+    nao tem valor nenhum para mostrar; os demais servem o snapshot, mesmo
+    velho, em vez de repetir as chamadas ao Agendor.
+    """
+    registro = _cache_compartilhado.read(chave)
+    if registro is not None and (registro[1] <= idade_max or not _lider.acquire()):
+        return registro[0]
+    return publicar_compartilhado(chave, calcular())
+
+
+def _carregar_dashboard():
+    return carregar_compartilhado('dashboard', obter_dashboard_tarefas_dados, DASHBOARD_CACHE_TTL * 2)
+
+
+def _construir_dashboard():
+    return publicar_compartilhado('dashboard', obter_dashboard_tarefas_dados())
 
 
 def obter_dashboard_cache():
-    with _dashboard_cache_lock:
-        dados = _dashboard_cache.get('dados')
-    if dados is None:
-        dados = obter_dashboard_tarefas_dados()
-        with _dashboard_cache_lock:
-            _dashboard_cache['dados'] = dados
+    dados = _dashboard_cache.get('dados', _carregar_dashboard)
+    registrar_versao_dashboard(dados)
     return dados
 
 
-def obter_ultima_venda_cacheada():
-    agora = monotonic()
-    with _ultima_venda_cache_lock:
-        ultima = _ultima_venda_cache.get('ultima')
-        last_check = _ultima_venda_cache.get('last_check', 0.0)
-        if agora - last_check < _ultima_venda_cache_ttl:
-            return ultima
-        _ultima_venda_cache['last_check'] = agora
+def registrar_versao_dashboard(dados):
+    """Guarda as ultimas versoes servidas para responder clientes com deltas."""
+    assinatura = dados.get('signature')
+    if not assinatura:
+        return
+    with _dashboard_historico_lock:
+        if assinatura in _dashboard_historico:
+            _dashboard_historico.move_to_end(assinatura)
+            return
+        _dashboard_historico[assinatura] = dados
+        while len(_dashboard_historico) > DASHBOARD_HISTORICO:
+            _dashboard_historico.popitem(last=False)
 
-    ganhos = fetch_deal_data(params_ganhos)
-    mes_atual = datetime.now().month
-    ano_atual = datetime.now().year
-    ultima_dt = None
-    for ganho in ganhos:
-        data_ref = data_negocio(ganho)
-        if not data_ref or data_ref.month != mes_atual or data_ref.year != ano_atual:
-            continue
-        if ultima_dt is None or data_ref > ultima_dt:
-            ultima_dt = data_ref
-
-    ultima_str = ultima_dt.strftime('%Y-%m-%d %H:%M:%S') if ultima_dt else None
-    with _ultima_venda_cache_lock:
-        _ultima_venda_cache['ultima'] = ultima_str
-        _ultima_venda_cache['last_check'] = agora
-    return ultima_str
-
-
-def _dashboard_updater_loop(intervalo=600):
-    while not _dashboard_stop_event.is_set():
-        atualizar_cache_dashboard()
-        if _dashboard_stop_event.wait(intervalo):
-            break
 
-@app.route('/analytics')
-def analytics():
-    if not session.get('logado'):
-        return redirect('/')
+def obter_versao_dashboard(assinatura):
+    with _dashboard_historico_lock:
+        return _dashboard_historico.get(assinatura)
 
-    ganhos_brutos = sorted(fetch_deal_data(params_ganhos), key=lambda x: x['Valor do Negócio'], reverse=True)
-    prospeccao = fetch_deal_meta(params_prospeccao)
-    quentes = fetch_deal_meta(params_quentes)
 
-    ano_atual = datetime.now().year
-    mes_atual = datetime.now().month
-    nome_mes = meses[mes_atual]
-    inicio_ano = date(ano_atual, 1, 1)
-    fim_ano = date(ano_atual, 12, 31)
+def calcular_delta_dashboard(base, atual):
+    """Campos que mudaram entre duas versoes; o ranking vai por posicao."""
+    campos = {
+        chave: valor for chave, valor in atual.items()
+        if chave not in ('ranking', 'signature') and base.get(chave) != valor
+    }
+    ranking_base = base.get('ranking') or []
+    ranking = atual.get('ranking') or []
+    alterados = {
+        posicao: item for posicao, item in enumerate(ranking)
+        if posicao >= len(ranking_base) or ranking_base[posicao] != item
+    }
+    return {
+        'delta': True,
+        'base': base.get('signature'),
+        'signature': atual.get('signature'),
+        'campos': campos,
+        'ranking': {'tamanho': len(ranking), 'alterados': alterados}
+    }
 
-    ganhos_ano = []
-    for ganho in ganhos_brutos:
-        data_ref = data_negocio(ganho)
-        if data_no_intervalo(data_ref, inicio_ano, fim_ano):
-            ganhos_ano.append((ganho, data_ref))
 
-    ganhos = [g for g, _ in ganhos_ano]
+def calcular_ultima_venda():
+    ultima = obter_agregado_vendas().ultima_venda
+    ultima_dt = ultima.data_ganho if ultima else None
+    return ultima_dt.strftime('%Y-%m-%d %H:%M:%S') if ultima_dt else None
 
-    try:
-        vendas_cotas = total_cotas(ano=ano_atual)
-    except Exception as e:
-        print(f"⚠️ Erro ao consultar cotas no banco: {e}")
-        vendas_cotas = 0
 
-    ganhos_mes = [
-        g for g, data_ref in ganhos_ano
-        if data_ref.month == mes_atual and data_ref.year == ano_atual
-    ]
-    vendas_anuais = sum(g['Valor do Negócio'] for g, _ in ganhos_ano)
-    vendas_mes = sum(g['Valor do Negócio'] for g in ganhos_mes)
-    print(f"Vendas anuais: {ganhos_ano}, Vendas mês: {vendas_mes}, Vendas cotas: {vendas_cotas}")
+def _carregar_ultima_venda():
+    return carregar_compartilhado('ultima-venda', calcular_ultima_venda, VENDAS_WATCH_INTERVAL * 4)
+
 
-    ganhos_mes_com_data = [g for g in ganhos_mes if data_negocio(g)]
-    ultima = max(ganhos_mes_com_data, key=lambda g: data_negocio(g), default=None)
+def obter_ultima_venda_cacheada():
+    return _ultima_venda_cache.get('ultima', _carregar_ultima_venda)
+
+
+class CanalVendas:
+    """Difunde mudancas da ultima venda para as conexoes SSE abertas.
+
+    Um unico observador em background consulta a ultima venda e publica aqui;
+    cada painel conectado recebe sua propria fila, entao o trafego para o
+    Agendor nao cresce com o numero de telas.
+    """
+
+    _NAO_OBSERVADO = object()
+
+    def __init__(self, tamanho_fila=8):
+        self._lock = threading.Lock()
+        self._assinantes = set()
+        self._tamanho_fila = tamanho_fila
+        self._ultima = self._NAO_OBSERVADO
+
+    @property
+    def ultima(self):
+        ultima = self._ultima
+        return None if ultima is self._NAO_OBSERVADO else ultima
+
+    @property
+    def observado(self):
+        return self._ultima is not self._NAO_OBSERVADO
+
+    def assinar(self, limite=None):
+        """Nova fila de eventos, ou None se ja houver `limite` conexoes."""
+        fila = queue.Queue(maxsize=self._tamanho_fila)
+        with self._lock:
+            if limite is not None and len(self._assinantes) >= limite:
+                return None
+            self._assinantes.add(fila)
+        return fila
+
+    def cancelar(self, fila):
+        with self._lock:
+            self._assinantes.discard(fila)
+
+    def conexoes(self):
+        with self._lock:
+            return len(self._assinantes)
+
+    def publicar(self, ultima):
+        with self._lock:
+            if ultima == self._ultima:
+                return False
+            primeira_leitura = self._ultima is self._NAO_OBSERVADO
+            self._ultima = ultima
+            assinantes = list(self._assinantes)
+        # A primeira leitura apos o start so define o estado inicial.
+        if primeira_leitura or ultima is None:
+            return False
+        for fila in assinantes:
+            try:
+                fila.put_nowait(ultima)
+            except queue.Full:
+                # Conexao lenta: ela ja tem eventos pendentes para recarregar.
+                pass
+        return True
+
+
+canal_vendas = CanalVendas()
+
+
+def verificar_nova_venda():
+    lider = _lider.acquire()
+    carregar = calcular_ultima_venda if lider else _carregar_ultima_venda
+    ultima = _ultima_venda_cache.refresh('ultima', carregar, strict=True)
+    if canal_vendas.observado and ultima != canal_vendas.ultima:
+        # Os paineis recarregam ao receber o evento: o view model
+        # precisa refletir a venda antes do aviso sair.
+        atualizar_painel_analytics(lider)
+    if lider:
+        publicar_compartilhado('ultima-venda', ultima)
+    if canal_vendas.publicar(ultima):
+        print(f"[vendas] Nova venda enviada para {canal_vendas.conexoes()} painel(is).")
+
+
+def _evento_sse(evento=None, dados=None, evento_id=None):
+    linhas = []
+    if evento_id is not None:
+        linhas.append(f"id: {evento_id}")
+    if evento:
+        linhas.append(f"event: {evento}")
+    if dados is not None:
+        linhas.append(f"data: {json.dumps(dados)}")
+    return "\n".join(linhas) + "\n\n"
+
+def obter_dados_analytics():
+    """Numeros do painel de analytics num dict JSON, pronto para cache e snapshot."""
+    def cotas_do_ano():
+        try:
+            return total_cotas(ano=datetime.now().year)
+        except Exception as e:
+            print(f"⚠️ Erro ao consultar cotas no banco: {e}")
+            return 0
+
+    def campanha_ativa():
+        campanha = Campanha.query.filter_by(ativo=True).first()
+        return {'nome': campanha.nome} if campanha else None
+
+    fontes = buscar_em_paralelo(
+        agregado=obter_agregado_vendas,
+        prospeccao=lambda: fetch_deal_meta(params_prospeccao),
+        quentes=lambda: fetch_deal_meta(params_quentes),
+        vendas_cotas=cotas_do_ano,
+        campanha_ativa=campanha_ativa,
+        consultores=diretorio_consultores.carregar,
+    )
+    agregado = fontes['agregado']
+    prospeccao = fontes['prospeccao']
+    quentes = fontes['quentes']
+    vendas_cotas = fontes['vendas_cotas']
+
+    ano_atual = agregado.ano
+    mes_atual = agregado.mes
+
+    vendas_anuais = agregado.vendas_anuais
+    vendas_mes = agregado.vendas_mes
+    print(f"Vendas anuais: {vendas_anuais}, Vendas mês: {vendas_mes}, Vendas cotas: {vendas_cotas}")
+
+    ultima = agregado.ultima_venda
     ultima_consultora = None
     if ultima:
-        data_ultima = data_negocio(ultima)
-        consultor = Consultor.query.filter_by(id_agendor=str(ultima['ConsultorId'])).first()
+        data_ultima = ultima.data_ganho
+        consultor = diretorio_consultores.buscar(id_agendor=ultima.consultor_id, nome=ultima.consultor)
         ultima_consultora = {
-            'nome': ultima['Consultor'],
-            'valor': ultima['Valor do Negócio'],
+            'nome': ultima.consultor,
+            'valor': ultima.valor,
             'data': data_ultima.strftime('%d/%m/%Y') if data_ultima else '',
-            'imagem_base64': consultor.imagem_base64 if consultor else None
+            'imagem_url': consultor.imagem_url if consultor else None
         }
 
-    porcentagem_churras, texto_churras, cor_churras = update_progress(ganhos, mes_atual, ano_atual)
-    porcentagem_campanha, texto_campanha, cor_campanha, valor_atual, meta_campanha = calcular_progresso_campanha()
-
-    agregado = defaultdict(lambda: {'nome': None, 'total': 0})
-    for g in ganhos_mes:
-        cid = g['ConsultorId']
-        agregado[cid]['nome'] = g['Consultor']
-        agregado[cid]['total'] += g['Valor do Negócio']
-
-    ranking_raw = sorted([
-        {'ConsultorId': cid, **info} for cid, info in agregado.items()
-    ], key=lambda x: x['total'], reverse=True)[:3]
+    porcentagem_churras, texto_churras, cor_churras = update_progress(vendas_mes, mes_atual, ano_atual)
+    porcentagem_campanha, texto_campanha, cor_campanha, valor_atual, meta_campanha = calcular_progresso_campanha(agregado)
 
     ranking = []
-    for item in ranking_raw:
-        consultor = Consultor.query.filter_by(id_agendor=str(item['ConsultorId'])).first()
+    for item in agregado.ranking(3):
+        consultor = diretorio_consultores.buscar(id_agendor=item['consultor_id'], nome=item['nome'])
         ranking.append({
             'nome': item['nome'],
             'total': item['total'],
-            'imagem_base64': consultor.imagem_base64 if consultor and consultor.imagem_base64 else None
+            'imagem_url': consultor.imagem_url if consultor else None
         })
 
-    propagandas_ativas = Propaganda.query.filter_by(ativo=True).all()
-
-    negocios_ganhos = sorted(listar_negocios_ganhos(), key=lambda x: x['valor'], reverse=True)
-
-    return render_template('analytics.html',
-                           propagandas=propagandas_ativas,
-                           vendas_anuais=vendas_anuais,
-                           vendas_cotas=vendas_cotas,
-                           vendas_mes=vendas_mes,
-                           porcentagem_churras=porcentagem_churras,
-                           texto_churras=texto_churras,
-                           cor_churras=cor_churras,
-                           nome_mes=nome_mes,
-                           ultima_consultora=ultima_consultora,
-                           prospeccao=prospeccao,
-                           quentes=quentes,
-                           ranking=ranking,
-                           valor_atual=valor_atual,
-                           meta_campanha=meta_campanha,
-                           campanha_ativa=Campanha.query.filter_by(ativo=True).first(),
-                           porcentagem_campanha=porcentagem_campanha,
-                           texto_campanha=texto_campanha,
-                           cor_campanha=cor_campanha,
-                           negocios_ganhos=negocios_ganhos)
+    return {
+        'vendas_anuais': vendas_anuais,
+        'vendas_cotas': vendas_cotas,
+        'vendas_mes': vendas_mes,
+        'porcentagem_churras': porcentagem_churras,
+        'texto_churras': texto_churras,
+        'cor_churras': cor_churras,
+        'nome_mes': meses[mes_atual],
+        'ultima_consultora': ultima_consultora,
+        'prospeccao': prospeccao,
+        'quentes': quentes,
+        'ranking': ranking,
+        'negocios_ganhos_mes': len(agregado.negocios_mes),
+        'valor_atual': valor_atual,
+        'meta_campanha': meta_campanha,
+        'campanha_ativa': fontes['campanha_ativa'],
+        'porcentagem_campanha': porcentagem_campanha,
+        'texto_campanha': texto_campanha,
+        'cor_campanha': cor_campanha,
+        'gerado_em': datetime.now().isoformat()
+    }
+
+
+@dataclass(frozen=True, slots=True)
+class PainelAnalytics:
+    """View model imutavel do /analytics; `versao` muda so quando os dados mudam."""
+    versao: str
+    gerado_em: str
+    contexto: MappingProxyType
+
+    @classmethod
+    def de_dados(cls, dados):
+        conteudo = {chave: valor for chave, valor in dados.items() if chave != 'gerado_em'}
+        versao = hashlib.md5(json.dumps(conteudo, sort_keys=True, default=str).encode()).hexdigest()
+        return cls(versao=versao, gerado_em=dados.get('gerado_em'), contexto=MappingProxyType(dict(dados)))
+
+
+def construir_dados_painel():
+    """Dados do analytics mais os banners ativos: tudo que o template precisa."""
+    dados = obter_dados_analytics()
+    dados['propagandas'] = [
+        {'id': p.id, 'titulo': p.titulo, 'imagem_versao': p.imagem_versao}
+        for p in db.session.query(Propaganda.id, Propaganda.titulo, versao_imagem_sql(Propaganda))
+        .filter(Propaganda.ativo.is_(True))
+        .order_by(Propaganda.id)
+    ]
+    return dados
+
+
+def _construir_painel():
+    return PainelAnalytics.de_dados(publicar_compartilhado('analytics', construir_dados_painel()))
+
+
+def _carregar_analytics():
+    return PainelAnalytics.de_dados(
+        carregar_compartilhado('analytics', construir_dados_painel, ANALYTICS_CACHE_TTL * 2)
+    )
+
+
+def atualizar_painel_analytics(lider):
+    """Reconstroi o view model (lider) ou o rele do snapshot compartilhado."""
+    contexto = nullcontext() if has_app_context() else app.app_context()
+    try:
+        with contexto:
+            _analytics_cache.refresh('dados', _construir_painel if lider else _carregar_analytics)
+    except Exception as e:
+        print(f"⚠️ Falha ao atualizar painel de analytics: {e}")
+
+
+def agendar_painel_analytics():
+    """Cadastro alterado (banner/consultor): pede a tarefa 'analytics' agora.
+
+    Se ela ja estiver rodando (com a lista antiga), roda de novo ao terminar;
+    so o lider reconstroi, os demais releem o snapshot.
+    """
+    agendador.trigger('analytics')
+
+
+def obter_painel_analytics():
+    # Valor velho e servido na hora e revalidado em background; so o primeiro
+    # acesso de um processo sem snapshot espera a construcao.
+    return _analytics_cache.get('dados', _carregar_analytics)
+
+
+def versao_painel_atual():
+    painel = _analytics_cache.peek('dados')
+    return painel.versao if painel else None
+
+
+def dados_api_analytics(painel):
+    dados = dict(painel.contexto)
+    dados['versao'] = painel.versao
+    dados['propagandas'] = [
+        dict(p, imagem_url=url_imagem('propaganda', p['id'], p['imagem_versao']))
+        for p in dados.get('propagandas', [])
+    ]
+    return dados
+
+
+@app.route('/analytics')
+def analytics():
+    if not session.get('logado'):
+        return redirect('/')
+
+    painel = obter_painel_analytics()
+    return render_template(
+        'analytics.html',
+        versao_painel=painel.versao,
+        dados_painel=dados_api_analytics(painel),
+        **painel.contexto
+    )
+
+
+@app.route('/api/analytics')
+def api_analytics():
+    if not session.get('logado'):
+        return jsonify({'error': 'unauthorized'}), 401
+    painel = obter_painel_analytics()
+    if request.if_none_match.contains(painel.versao):
+        response = make_response('', 304)
+    else:
+        response = jsonify(dados_api_analytics(painel))
+    response.set_etag(painel.versao)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 
 @app.route('/console/ganhos-mes')
@@ -648,7 +1219,37 @@ def api_dashboard_tarefas():
     if not session.get('logado'):
         return jsonify({'error': 'unauthorized'}), 401
     dados = obter_dashboard_cache()
-    return jsonify(dados)
+    assinatura = dados.get('signature')
+    desde = request.args.get('desde')
+    if assinatura and request.if_none_match.contains(assinatura):
+        response = make_response('', 304)
+    elif desde and desde != assinatura and obter_versao_dashboard(desde) is not None:
+        response = jsonify(calcular_delta_dashboard(obter_versao_dashboard(desde), dados))
+    else:
+        # Versao desconhecida (expirou do historico ou outro processo): envia tudo.
+        response = jsonify(dados)
+    if assinatura:
+        response.set_etag(assinatura)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/agendor/fila')
+def api_agendor_fila():
+    if not session.get('logado'):
+        return jsonify({'error': 'unauthorized'}), 401
+    return jsonify({
+        'filas': AGENDOR_CLIENT.stats(),
+        'limite': AGENDOR_CLIENT.rate_limit_state()
+    })
+
+@app.route('/api/agendador')
+def api_agendador():
+    if not session.get('logado'):
+        return jsonify({'error': 'unauthorized'}), 401
+    return jsonify({
+        'lider': _lider.is_leader,
+        'tarefas': agendador.stats()
+    })
 
 @app.route('/verificar-novas-vendas')
 def verificar_novas_vendas():
@@ -663,6 +1264,63 @@ def verificar_novas_vendas():
     return jsonify({'temNovaVenda': False})
 
 
+@app.route('/stream/vendas')
+def stream_vendas():
+    if not session.get('logado'):
+        return jsonify({'error': 'unauthorized'}), 401
+    ultimo_id = request.headers.get('Last-Event-ID')
+    fila = canal_vendas.assinar(limite=SSE_MAX_CONEXOES)
+    if fila is None:
+        # O painel volta a tentar sozinho e, enquanto isso, segue no polling.
+        response = Response('', status=503)
+        response.headers['Retry-After'] = '60'
+        return response
+    encerrar_em = monotonic() + SSE_DURACAO_MAX
+
+    def eventos():
+        try:
+            yield "retry: 10000\n\n"
+            if canal_vendas.observado:
+                atual = canal_vendas.ultima or ''
+                # Reconexao: avisa da venda que aconteceu enquanto estava fora.
+                if ultimo_id is not None and ultimo_id != atual:
+                    yield _evento_sse('nova-venda', {'ultima': atual, 'versao': versao_painel_atual()}, atual)
+                else:
+                    yield _evento_sse(evento_id=atual)
+            while True:
+                restante = encerrar_em - monotonic()
+                if restante <= 0:
+                    # Libera a thread; o cliente reconecta com Last-Event-ID.
+                    return
+                try:
+                    ultima = fila.get(timeout=min(SSE_HEARTBEAT, restante))
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                # O painel ja foi reconstruido antes do aviso: a versao diz ao
+                # cliente qual resposta de /api/analytics inclui a venda.
+                yield _evento_sse('nova-venda', {'ultima': ultima, 'versao': versao_painel_atual()}, ultima)
+        finally:
+            canal_vendas.cancelar(fila)
+
+    response = Response(eventos(), mimetype='text/event-stream')
+    # Cliente que cai antes do primeiro evento nunca executa o finally.
+    response.call_on_close(lambda: canal_vendas.cancelar(fila))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@app.route('/img/consultor/<int:id>')
+def imagem_consultor(id):
+    return servir_imagem('consultor', id)
+
+
+@app.route('/img/propaganda/<int:id>')
+def imagem_propaganda(id):
+    return servir_imagem('propaganda', id)
+
+
 @app.route('/logout')
 def logout():
     session.pop('logado', None)
@@ -673,65 +1331,101 @@ def propagandas():
     if request.method == 'POST':
         titulo = request.form['titulo']
         ativo = 'ativo' in request.form
-        imagem = request.files['imagem']
-        imagem_base64 = base64.b64encode(imagem.read()).decode('utf-8') if imagem else None
+        try:
+            variantes = ler_upload_imagem('propaganda', request.files.get('imagem'))
+        except ImagemInvalida:
+            flash("Arquivo de imagem invalido.", "danger")
+            return redirect('/propagandas')
 
-        nova = Propaganda(titulo=titulo, imagem_base64=imagem_base64, ativo=ativo)
+        nova = Propaganda(titulo=titulo, ativo=ativo)
         db.session.add(nova)
+        if variantes:
+            db.session.flush()
+            salvar_variantes('propaganda', nova.id, variantes)
         db.session.commit()
+        agendar_painel_analytics()
         return redirect('/propagandas')
 
-    propagandas = Propaganda.query.order_by(Propaganda.id.desc()).all()
-    return render_template('propagandas.html', propagandas=propagandas)
+    colunas = db.session.query(Propaganda.id, Propaganda.titulo, Propaganda.ativo, versao_imagem_sql(Propaganda))
+    # Todas as ativas, sem paginar: sao as que estao rodando nas TVs, e a
+    # consulta traz so colunas leves.
+    ativas = colunas.filter(Propaganda.ativo.is_(True)).order_by(Propaganda.id.desc()).all()
+    propagandas, proximo = paginar_por_id(
+        colunas, Propaganda.id, apos=request.args.get('apos', type=int), decrescente=True
+    )
+    return render_template('propagandas.html', ativas=ativas, propagandas=propagandas, proximo=proximo)
 
 @app.route('/propaganda/toggle/<int:id>', methods=['POST'])
 def toggle_propaganda(id):
     propaganda = Propaganda.query.get_or_404(id)
     propaganda.ativo = not propaganda.ativo
     db.session.commit()
+    agendar_painel_analytics()
     return redirect('/propagandas')
 
 @app.route('/propaganda/deletar/<int:id>', methods=['POST'])
 def deletar_propaganda(id):
     propaganda = Propaganda.query.get_or_404(id)
     db.session.delete(propaganda)
+    remover_variantes('propaganda', id)
     db.session.commit()
+    agendar_painel_analytics()
     return redirect('/propagandas')
 
 @app.route('/consultores')
 def consultores():
-    consultores = Consultor.query.all()
-    return render_template('consultores.html', consultores=consultores)
+    colunas = db.session.query(
+        Consultor.id,
+        Consultor.nome,
+        Consultor.id_agendor,
+        Consultor.ativo,
+        versao_imagem_sql(Consultor)
+    )
+    consultores, proximo = paginar_por_id(colunas, Consultor.id, apos=request.args.get('apos', type=int))
+    return render_template('consultores.html', consultores=consultores, proximo=proximo)
 
 @app.route('/consultor/toggle/<int:id>', methods=['POST'])
 def toggle_consultor(id):
     consultor = Consultor.query.get_or_404(id)
     consultor.ativo = not consultor.ativo
     db.session.commit()
+    diretorio_consultores.invalidar()
+    agendar_painel_analytics()
     return redirect('/consultores')
 
 @app.route('/consultor/deletar/<int:id>', methods=['POST'])
 def deletar_consultor(id):
     consultor = Consultor.query.get_or_404(id)
     db.session.delete(consultor)
+    remover_variantes('consultor', id)
     db.session.commit()
+    diretorio_consultores.invalidar()
+    agendar_painel_analytics()
     return redirect('/consultores')
 
 @app.route('/consultor/editar/<int:id>', methods=['GET', 'POST'])
 def editarConsultor(id):
     consultor = Consultor.query.get_or_404(id)
     if request.method == 'POST':
+        try:
+            variantes = ler_upload_imagem('consultor', request.files.get('imagem'))
+        except ImagemInvalida:
+            flash("Arquivo de imagem invalido.", "danger")
+            return redirect(f'/consultor/editar/{id}')
+
         consultor.nome = request.form['nome']
         consultor.id_agendor = request.form['id_agendor']
         consultor.ativo = 'ativo' in request.form
-
-        imagem = request.files.get('imagem')
-        if imagem and imagem.filename != '':
-            consultor.imagem_base64 = base64.b64encode(imagem.read()).decode('utf-8')
+        if variantes:
+            consultor.imagem_base64 = None
+            salvar_variantes('consultor', consultor.id, variantes)
 
         db.session.commit()
+        diretorio_consultores.invalidar()
+        agendar_painel_analytics()
         return redirect('/consultores')
-    return render_template('edit.html', consultor=consultor)
+    imagem_versao = db.session.query(versao_imagem_sql(Consultor)).filter(Consultor.id == id).scalar()
+    return render_template('edit.html', consultor=consultor, imagem_versao=imagem_versao)
 
 @app.route('/consultor/novo', methods=['POST'])
 def novoConsultor():
@@ -739,15 +1433,20 @@ def novoConsultor():
     id_agendor = request.form['id_agendor']
     ativo = 'ativo' in request.form
 
-    imagem = request.files['imagem']
-    if imagem:
-        imagem_base64 = base64.b64encode(imagem.read()).decode('utf-8')
-    else:
-        imagem_base64 = None
+    try:
+        variantes = ler_upload_imagem('consultor', request.files.get('imagem'))
+    except ImagemInvalida:
+        flash("Arquivo de imagem invalido.", "danger")
+        return redirect('/consultores')
 
-    consultor = Consultor(nome=nome, id_agendor=id_agendor, imagem_base64=imagem_base64, ativo=ativo)
+    consultor = Consultor(nome=nome, id_agendor=id_agendor, ativo=ativo)
     db.session.add(consultor)
+    if variantes:
+        db.session.flush()
+        salvar_variantes('consultor', consultor.id, variantes)
     db.session.commit()
+    diretorio_consultores.invalidar()
+    agendar_painel_analytics()
     return redirect('/consultores')
 
 @app.route('/campanhas', methods=['GET', 'POST'])
@@ -791,6 +1490,7 @@ def campanhas():
             flash("Campanha criada com sucesso.")
 
         db.session.commit()
+        agendar_painel_analytics()
         return redirect('/campanhas')
 
     campanhas = Campanha.query.order_by(Campanha.data_inicio.desc()).all()
@@ -812,24 +1512,151 @@ def toggle_campanha(id):
     campanha = Campanha.query.get_or_404(id)
     campanha.ativo = not campanha.ativo
     db.session.commit()
+    agendar_painel_analytics()
     return redirect('/campanhas')
 
-@app.before_request
-def iniciar_atualizador_dashboard():
-    global _dashboard_thread
-    if _dashboard_thread is None:
-        _dashboard_thread = threading.Thread(
-            target=_dashboard_updater_loop,
-            args=(600,),
-            daemon=True
-        )
-        _dashboard_thread.start()
+@app.cli.command('criar-tabelas')
+def criar_tabelas_comando():
+    """Cria as tabelas que ainda nao existem."""
+    if not criar_tabelas():
+        raise SystemExit(1)
+    click.echo("Tabelas verificadas.")
+
+@app.cli.command('sincronizar-negocios')
+@click.option('--completo', is_flag=True, help='Ignora o watermark e refaz o espelho desde o inicio do ano.')
+def sincronizar_negocios(completo):
+    total = sync_deal_store(full=completo)
+    click.echo(f"{total} negocios sincronizados.")
+
+@app.cli.command('converter-imagens')
+@click.option('--manter-original', is_flag=True, help='Mantem imagem_base64 depois de gerar as variantes.')
+def converter_imagens(manter_original):
+    """Gera as variantes dos registros que ainda so tem o arquivo original."""
+    convertidos, falhas = converter_imagens_pendentes(manter_original)
+    click.echo(f"{convertidos} imagens convertidas, {falhas} com erro.")
+
+
+def converter_imagens_pendentes(manter_original=False):
+    """Converte em variantes os registros sem variantes; devolve (convertidos, falhas)."""
+    convertidos = falhas = 0
+    for tipo, modelo in IMAGEM_MODELOS.items():
+        ja_convertidos = db.select(ImagemVariante.dono_id).where(ImagemVariante.dono_tipo == tipo)
+        ids = [
+            obj_id for (obj_id,) in db.session.query(modelo.id)
+            .filter(modelo.imagem_base64.isnot(None), modelo.id.notin_(ja_convertidos))
+            .order_by(modelo.id)
+        ]
+        # Um registro por vez: os originais podem ter varios MB cada.
+        for obj_id in ids:
+            registro = db.session.get(modelo, obj_id)
+            try:
+                variantes = gerar_variantes(base64.b64decode(registro.imagem_base64), TAMANHOS_POR_TIPO[tipo])
+            except (ImagemInvalida, ValueError) as exc:
+                print(f"⚠️ {tipo} {obj_id}: imagem ignorada ({exc})")
+                db.session.rollback()
+                falhas += 1
+                continue
+            salvar_variantes(tipo, obj_id, variantes)
+            if not manter_original:
+                registro.imagem_base64 = None
+            db.session.commit()
+            db.session.expunge_all()
+            convertidos += 1
+    if convertidos:
+        diretorio_consultores.invalidar()
+    return convertidos, falhas
+
+def aquecer_caches():
+    """Warm start: semeia os caches locais com o ultimo snapshot persistido.
+
+    Roda no inicio de cada processo (iniciar_agendador), nao no import. Os
+    valores entram como velhos: sao servidos na hora e o primeiro acesso
+    dispara a revalidacao em background, que nos nao lideres so rele a tabela
+    compartilhada. Sem snapshot, o primeiro acesso calcula.
+    """
+    caches = (
+        (_dashboard_cache, 'dados', 'dashboard', None),
+        (_analytics_cache, 'dados', 'analytics', PainelAnalytics.de_dados),
+        (_ultima_venda_cache, 'ultima', 'ultima-venda', None),
+    )
+    with app.app_context():
+        for cache, chave, chave_compartilhada, converter in caches:
+            registro = _cache_compartilhado.read(chave_compartilhada)
+            if registro is None:
+                continue
+            valor, idade = registro
+            cache.set(chave, converter(valor) if converter else valor, stale=True)
+            print(f"[cache] {chave_compartilhada} restaurado do snapshot ({idade:.0f}s).")
+
+
+# Trabalho periodico, cada fonte no seu ritmo. As tarefas que consultam o
+# Agendor rodam so no lider; analytics e ultima venda rodam em todo worker
+# (o nao lider rele o snapshot publicado).
+agendador = Scheduler(context=contexto_segundo_plano, idle_recheck=LIDER_VERIFICACAO, name='agendador')
+
+
+def tarefa_sincronizar_negocios():
+    sync_deal_store()
+
+
+def tarefa_reconciliar_negocios():
+    # Carga completa: tambem remove do espelho os negocios excluidos no Agendor.
+    sync_deal_store(full=True)
+
+
+def tarefa_converter_imagens():
+    # Registros antigos so ganham URL de imagem depois de convertidos; o
+    # original fica guardado (a remocao e decisao do `flask converter-imagens`).
+    convertidos, falhas = converter_imagens_pendentes(manter_original=True)
+    if convertidos:
+        print(f"[imagens] {convertidos} imagens convertidas, {falhas} com erro.")
+        agendar_painel_analytics()
+
+
+def tarefa_contagem_tarefas():
+    inicio_mes, fim_mes = periodo_mes_atual()
+    _tarefas_cache.refresh(
+        _chave_tarefas(inicio_mes), lambda: contar_tarefas_mes(inicio_mes, fim_mes), strict=True
+    )
+
+
+def tarefa_dashboard():
+    # Rollup semanal das cotas, meta vigente e ranking; as contagens de
+    # tarefas entram pelo cache da tarefa 'contagem-tarefas'.
+    _dashboard_cache.refresh('dados', _construir_dashboard, strict=True)
+
+
+def tarefa_analytics():
+    carregar = _construir_painel if _lider.acquire() else _carregar_analytics
+    _analytics_cache.refresh('dados', carregar, strict=True)
+
+
+agendador.register('sincronizar-negocios', tarefa_sincronizar_negocios, DEAL_SYNC_INTERVAL,
+                   jitter=5, timeout=300, condition=_lider.acquire)
+agendador.register('reconciliar-negocios', tarefa_reconciliar_negocios, DEAL_RECONCILE_INTERVAL,
+                   jitter=600, timeout=1800, condition=_lider.acquire, run_at_start=False)
+agendador.register('converter-imagens', tarefa_converter_imagens, 3600,
+                   jitter=60, timeout=900, condition=_lider.acquire)
+agendador.register('contagem-tarefas', tarefa_contagem_tarefas, TAREFAS_INTERVAL,
+                   jitter=30, timeout=300, condition=_lider.acquire)
+agendador.register('dashboard', tarefa_dashboard, DASHBOARD_CACHE_TTL,
+                   jitter=10, timeout=180, condition=_lider.acquire)
+agendador.register('analytics', tarefa_analytics, ANALYTICS_CACHE_TTL, jitter=5, timeout=180)
+agendador.register('ultima-venda', verificar_nova_venda, VENDAS_WATCH_INTERVAL, jitter=3, timeout=120)
+
+
+def iniciar_agendador():
+    """Inicio de processo: semeia os caches e sobe o agendador.
+
+    Chamado pelo hook post_fork do gunicorn (gunicorn.conf.py) em cada worker
+    e pelo `__main__`, sem esperar a primeira request.
+    """
+    if agendador.started:
+        return
+    aquecer_caches()
+    agendador.start()
 
 if __name__ == '__main__':
-    with app.app_context():
-        try:
-            db.create_all()
-        except Exception as e:
-            print(f"⚠️ Não foi possível criar/verificar tabelas: {e}")
-    iniciar_atualizador_dashboard()
+    criar_tabelas()
+    iniciar_agendador()
     app.run(host='0.0.0.0', port=8182, debug=False)
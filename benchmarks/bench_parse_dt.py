@@ -0,0 +1,72 @@
+"""Micro-benchmark de parse_dt_safe contra o parser generico do dateutil.
+
+Gera um ano de timestamps no formato devolvido pelo Agendor (um a cada 30
+minutos, com alguns offsets explicitos) e mede cada caminho:
+
+    python benchmarks/bench_parse_dt.py
+"""
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dateutil import parser as dateutil_parser
+
+from utils_agendor import _parse_dt_text, parse_dt_safe
+
+REPETICOES = 5
+
+
+def gerar_timestamps():
+    inicio = datetime(datetime.now().year, 1, 1, tzinfo=timezone.utc)
+    timestamps = []
+    for i in range(365 * 48):
+        instante = inicio + timedelta(minutes=30 * i)
+        if i % 10 == 0:
+            timestamps.append(instante.astimezone(timezone(timedelta(hours=-3))).isoformat())
+        else:
+            timestamps.append(instante.strftime("%Y-%m-%dT%H:%M:%S.000Z"))
+    return timestamps
+
+
+def caminho_antigo(valores):
+    for valor in valores:
+        dateutil_parser.parse(valor)
+
+
+def caminho_novo(valores):
+    for valor in valores:
+        parse_dt_safe(valor)
+
+
+def main():
+    timestamps = gerar_timestamps()
+    for valor in timestamps[:50]:
+        assert parse_dt_safe(valor) == dateutil_parser.parse(valor), valor
+
+    antigo = min(timeit.repeat(lambda: caminho_antigo(timestamps), number=1, repeat=REPETICOES))
+
+    def frio():
+        _parse_dt_text.cache_clear()
+        caminho_novo(timestamps)
+
+    novo_frio = min(timeit.repeat(frio, number=1, repeat=REPETICOES))
+
+    # Cenario do painel: os mesmos timestamps do mes corrente reprocessados a cada refresh.
+    mes = timestamps[-30 * 48:]
+    antigo_mes = min(timeit.repeat(lambda: caminho_antigo(mes), number=1, repeat=REPETICOES))
+    caminho_novo(mes)
+    novo_quente = min(timeit.repeat(lambda: caminho_novo(mes), number=1, repeat=REPETICOES))
+
+    print(f"{len(timestamps)} timestamps, melhor de {REPETICOES} execucoes")
+    print(f"dateutil.parser.parse          : {antigo * 1000:8.1f} ms")
+    print(f"parse_dt_safe (cache vazio)    : {novo_frio * 1000:8.1f} ms  ({antigo / novo_frio:5.1f}x)")
+    print(f"{len(mes)} timestamps repetidos (mes corrente)")
+    print(f"dateutil.parser.parse          : {antigo_mes * 1000:8.1f} ms")
+    print(f"parse_dt_safe (cache quente)   : {novo_quente * 1000:8.1f} ms  ({antigo_mes / novo_quente:5.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+# Uso: gunicorn -c gunicorn.conf.py app:app
+#
+# /stream/vendas mantem uma conexao aberta por painel. Com workers sync cada TV
+# prenderia um processo inteiro; com gthread ela ocupa so uma thread, e o
+# app limita os streams por processo (SSE_MAX_CONEXOES) abaixo de `threads`.
+import os
+import subprocess
+import sys
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8182')
+workers = int(os.getenv('GUNICORN_WORKERS', '2'))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '16'))
+timeout = 60
+
+
+def on_starting(server):
+    # Tabelas criadas uma vez, no master, antes dos workers. Roda num processo
+    # a parte: importar o app aqui abriria conexoes e threads que o fork dos
+    # workers herdaria.
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'criar-tabelas'],
+                   cwd=os.path.dirname(os.path.abspath(__file__)), check=False)
+
+
+def post_fork(server, worker):
+    # Cada worker importa o app ja no processo filho e sobe o agendador
+    # (sincronizacao, contagens, warm start) sem esperar a primeira request.
+    from app import iniciar_agendador
+    iniciar_agendador()
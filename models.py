@@ -1,4 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func
 from sqlalchemy.dialects.postgresql import UUID
 import enum
 
@@ -27,7 +28,7 @@ class Consultor(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     nome = db.Column(db.String(100), nullable=False)
     id_agendor = db.Column(db.String(50), nullable=False)
-    imagem_base64 = db.Column(db.Text, nullable=True)
+    imagem_base64 = db.deferred(db.Column(db.Text, nullable=True))
     ativo = db.Column(db.Boolean, default=True)
 
 class Propaganda(db.Model):
@@ -35,7 +36,7 @@ class Propaganda(db.Model):
     __table_args__ = {'schema': 'dev'}  
     id = db.Column(db.Integer, primary_key=True)
     titulo = db.Column(db.String(100), nullable=False)
-    imagem_base64 = db.Column(db.Text, nullable=True)
+    imagem_base64 = db.deferred(db.Column(db.Text, nullable=True))
     ativo = db.Column(db.Boolean, default=True)
 
 
@@ -58,6 +59,44 @@ class Cota(db.Model):
     digito = db.Column(db.String(5), nullable=True)
     consultor_legado = db.Column('consultorLegado', db.String(255), nullable=True)
 
+    GRANULARIDADES = ('day', 'week', 'month')
+    AGRUPAMENTOS = ('consultor_id', 'administradora')
+    CAMPOS = ('valor', 'valor_total')
+
+    @classmethod
+    def somar_por_periodo(cls, granularidade='week', inicio=None, fim=None, campo='valor',
+                          agrupar_por=None, excluir_consultores=None):
+        """Soma `campo` por balde de tempo (date_trunc) numa unica consulta.
+
+        Cada linha traz `balde` (inicio do dia/semana/mes), `grupo` (quando
+        `agrupar_por` e informado) e `total`. Baldes sem cotas nao aparecem;
+        quem consome preenche os vazios.
+        """
+        if granularidade not in cls.GRANULARIDADES:
+            raise ValueError(f"granularidade invalida: {granularidade}")
+        if agrupar_por is not None and agrupar_por not in cls.AGRUPAMENTOS:
+            raise ValueError(f"agrupamento invalido: {agrupar_por}")
+        if campo not in cls.CAMPOS:
+            raise ValueError(f"campo invalido: {campo}")
+
+        coluna = getattr(cls, campo)
+        balde = func.date_trunc(granularidade, cls.data_aquisicao).label('balde')
+        colunas = [balde]
+        grupos = [balde]
+        if agrupar_por is not None:
+            grupo = getattr(cls, agrupar_por)
+            colunas.append(grupo.label('grupo'))
+            grupos.append(grupo)
+
+        query = db.session.query(*colunas, func.coalesce(func.sum(coluna), 0).label('total'))
+        if inicio is not None:
+            query = query.filter(cls.data_aquisicao >= inicio)
+        if fim is not None:
+            query = query.filter(cls.data_aquisicao <= fim)
+        if excluir_consultores:
+            query = query.filter(~cls.consultor_id.in_(tuple(excluir_consultores)))
+        return query.group_by(*grupos).order_by(balde).all()
+
 
 class Meta(db.Model):
     __tablename__ = 'metas'
@@ -70,3 +109,58 @@ class Meta(db.Model):
     data_fim = db.Column('dataFim', db.Date, nullable=True)
     created_at = db.Column('createdAt', db.DateTime(timezone=True), nullable=False)
     updated_at = db.Column('updatedAt', db.DateTime(timezone=True), nullable=False)
+
+
+class NegocioAgendor(db.Model):
+    __tablename__ = 'negocios_agendor'
+    __table_args__ = {'schema': 'dev'}
+
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    nome = db.Column(db.String(255), nullable=True)
+    valor = db.Column(db.Float, nullable=False, default=0)
+    etapa_id = db.Column(db.BigInteger, nullable=True)
+    etapa = db.Column(db.String(255), nullable=True)
+    funil = db.Column(db.String(255), nullable=True)
+    status_id = db.Column(db.Integer, nullable=True, index=True)
+    status = db.Column(db.String(100), nullable=True)
+    consultor_id = db.Column(db.BigInteger, nullable=True)
+    consultor = db.Column(db.String(255), nullable=True)
+    data_final = db.Column(db.DateTime(timezone=True), nullable=True, index=True)
+    atualizado_em = db.Column(db.DateTime(timezone=True), nullable=True, index=True)
+    sincronizado_em = db.Column(db.DateTime(timezone=True), nullable=False)
+
+
+class SincronizacaoAgendor(db.Model):
+    __tablename__ = 'sincronizacoes_agendor'
+    __table_args__ = {'schema': 'dev'}
+
+    recurso = db.Column(db.String(50), primary_key=True)
+    watermark = db.Column(db.DateTime(timezone=True), nullable=True)
+    ultima_execucao = db.Column(db.DateTime(timezone=True), nullable=True)
+
+
+class ImagemVariante(db.Model):
+    __tablename__ = 'imagens_variantes'
+    __table_args__ = (
+        db.UniqueConstraint('dono_tipo', 'dono_id', 'tamanho'),
+        {'schema': 'dev'},
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    dono_tipo = db.Column(db.String(20), nullable=False)
+    dono_id = db.Column(db.Integer, nullable=False)
+    tamanho = db.Column(db.String(20), nullable=False)
+    mimetype = db.Column(db.String(50), nullable=False)
+    largura = db.Column(db.Integer, nullable=False)
+    altura = db.Column(db.Integer, nullable=False)
+    versao = db.Column(db.String(32), nullable=False)
+    conteudo = db.deferred(db.Column(db.LargeBinary, nullable=False))
+
+
+class CacheCompartilhado(db.Model):
+    __tablename__ = 'cache_compartilhado'
+    __table_args__ = {'schema': 'dev'}
+
+    chave = db.Column(db.String(100), primary_key=True)
+    valor = db.Column(db.Text, nullable=True)
+    atualizado_em = db.Column(db.DateTime(timezone=True), nullable=False)
@@ -0,0 +1,136 @@
+import threading
+import time
+
+import pytest
+
+from utils_cache import StaleWhileRevalidateCache
+
+
+class Contador:
+    """Loader que conta chamadas e pode demorar ou falhar sob demanda."""
+
+    def __init__(self, valor="v", espera=0.0):
+        self.valor = valor
+        self.espera = espera
+        self.falhar = False
+        self.chamadas = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.chamadas += 1
+            n = self.chamadas
+        time.sleep(self.espera)
+        if self.falhar:
+            raise RuntimeError("agendor fora")
+        return f"{self.valor}{n}"
+
+
+def aguardar(condicao, limite=2.0):
+    fim = time.monotonic() + limite
+    while time.monotonic() < fim:
+        if condicao():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_misses_concorrentes_carregam_uma_vez():
+    cache = StaleWhileRevalidateCache(ttl=60)
+    loader = Contador(espera=0.2)
+    barreira = threading.Barrier(8)
+    resultados = []
+
+    def pedir():
+        barreira.wait()
+        resultados.append(cache.get("k", loader))
+
+    threads = [threading.Thread(target=pedir) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert loader.chamadas == 1
+    assert resultados == ["v1"] * 8
+
+
+def test_valor_fresco_nao_recarrega():
+    cache = StaleWhileRevalidateCache(ttl=60)
+    loader = Contador()
+    assert cache.get("k", loader) == "v1"
+    assert cache.get("k", loader) == "v1"
+    assert loader.chamadas == 1
+
+
+def test_valor_velho_e_servido_e_recalculado_em_background():
+    cache = StaleWhileRevalidateCache(ttl=0.05, stale_ttl=60)
+    loader = Contador(espera=0.2)
+    assert cache.get("k", loader) == "v1"
+    time.sleep(0.1)
+
+    inicio = time.monotonic()
+    assert cache.get("k", loader) == "v1"
+    assert time.monotonic() - inicio < 0.1
+    assert cache.get("k", loader) == "v1"  # nao dispara um segundo recomputo
+
+    assert aguardar(lambda: cache.peek("k") == "v2")
+    assert loader.chamadas == 2
+
+
+def test_valor_expirado_recarrega_na_hora():
+    cache = StaleWhileRevalidateCache(ttl=0.05, stale_ttl=0)
+    loader = Contador()
+    assert cache.get("k", loader) == "v1"
+    time.sleep(0.1)
+    assert cache.get("k", loader) == "v2"
+
+
+def test_set_stale_serve_snapshot_e_revalida():
+    cache = StaleWhileRevalidateCache(ttl=60, stale_ttl=60)
+    loader = Contador()
+    cache.set("k", "snapshot", stale=True)
+    assert cache.get("k", loader) == "snapshot"
+    assert aguardar(lambda: cache.peek("k") == "v1")
+
+
+def test_falha_mantem_ultimo_valor_bom_e_respeita_retry_after():
+    cache = StaleWhileRevalidateCache(ttl=0.05, stale_ttl=0, retry_after=0.3)
+    loader = Contador()
+    assert cache.get("k", loader) == "v1"
+    time.sleep(0.1)
+
+    loader.falhar = True
+    assert cache.get("k", loader) == "v1"
+    assert cache.info("k")["last_error"] == "agendor fora"
+
+    # Dentro de retry_after o ultimo valor bom e servido sem nova tentativa.
+    assert cache.get("k", loader) == "v1"
+    assert loader.chamadas == 2
+
+    loader.falhar = False
+    time.sleep(0.35)
+    assert cache.get("k", loader) == "v3"
+
+
+def test_falha_sem_valor_anterior_propaga():
+    cache = StaleWhileRevalidateCache(ttl=60)
+    loader = Contador()
+    loader.falhar = True
+    with pytest.raises(RuntimeError):
+        cache.get("k", loader)
+
+
+def test_refresh_strict_propaga_falha_mesmo_com_valor_anterior():
+    cache = StaleWhileRevalidateCache(ttl=60)
+    loader = Contador()
+    assert cache.get("k", loader) == "v1"
+
+    loader.falhar = True
+    assert cache.refresh("k", loader) == "v1"
+    with pytest.raises(RuntimeError):
+        cache.refresh("k", loader, strict=True)
+    assert cache.peek("k") == "v1"
+
+    loader.falhar = False
+    assert cache.refresh("k", loader, strict=True) == "v4"
@@ -0,0 +1,91 @@
+import threading
+import time
+
+from utils_scheduler import Scheduler
+
+
+class Falhador:
+    def __init__(self):
+        self.falhar = True
+        self.chamadas = 0
+
+    def __call__(self):
+        self.chamadas += 1
+        if self.falhar:
+            raise RuntimeError("falhou")
+
+
+def test_backoff_cresce_ate_o_teto_e_zera_no_sucesso():
+    agendador = Scheduler()
+    tarefa = Falhador()
+    job = agendador.register("t", tarefa, interval=10, max_backoff=50)
+
+    atrasos = []
+    for _ in range(4):
+        agendador._run(job)
+        atrasos.append(job.next_run - time.monotonic())
+    assert [round(a) for a in atrasos] == [20, 40, 50, 50]
+    assert job.consecutive_failures == 4
+    assert job.failures == 4
+
+    tarefa.falhar = False
+    agendador._run(job)
+    assert job.consecutive_failures == 0
+    assert job.failures == 4
+    assert job.last_error is None
+    assert round(job.next_run - time.monotonic()) == 10
+
+
+def test_backoff_padrao_e_oito_vezes_o_intervalo():
+    agendador = Scheduler()
+    job = agendador.register("t", Falhador(), interval=10)
+    job.consecutive_failures = 10
+    assert agendador._delay(job) == 80
+
+
+def test_jitter_fica_dentro_da_janela():
+    agendador = Scheduler()
+    job = agendador.register("t", Falhador(), interval=10, jitter=3)
+    atrasos = [agendador._delay(job) for _ in range(200)]
+    assert all(10 <= a <= 13 for a in atrasos)
+
+
+def test_execucao_acima_do_timeout_conta_como_falha():
+    agendador = Scheduler()
+    job = agendador.register("t", lambda: time.sleep(0.05), interval=10, timeout=0.01)
+    agendador._run(job)
+    assert job.consecutive_failures == 1
+    assert "demorou" in job.last_error
+
+
+def test_condition_recusada_nao_conta_como_falha():
+    agendador = Scheduler(idle_recheck=5)
+    tarefa = Falhador()
+    job = agendador.register("t", tarefa, interval=60, condition=lambda: False)
+    agendador._run(job)
+    assert tarefa.chamadas == 0
+    assert job.skipped == 1
+    assert job.consecutive_failures == 0
+    assert round(job.next_run - time.monotonic()) == 5
+
+
+def test_agendador_roda_e_reexecuta_com_trigger():
+    agendador = Scheduler(idle_recheck=0.05)
+    rodou = threading.Event()
+    chamadas = []
+
+    def tarefa():
+        chamadas.append(1)
+        rodou.set()
+
+    agendador.register("t", tarefa, interval=60)
+    agendador.start()
+    try:
+        assert rodou.wait(2)
+        rodou.clear()
+        agendador.trigger("t")
+        assert rodou.wait(2)
+        assert len(chamadas) == 2
+        assert agendador.stats()[0]["execucoes"] == 2
+    finally:
+        agendador.stop()
@@ -1,13 +1,26 @@
+import heapq
+import itertools
+import math
 import os
 import threading
 import time
-from queue import Queue
-from datetime import datetime, timezone
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import lru_cache
+from queue import PriorityQueue, Queue
+from datetime import datetime, timedelta, timezone
 from email.utils import parsedate_to_datetime
+from zoneinfo import ZoneInfo
 
 import requests
+from dateutil import parser as dateutil_parser
 from dotenv import load_dotenv
+from flask import has_app_context
 from requests.adapters import HTTPAdapter
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from models import db, NegocioAgendor, SincronizacaoAgendor
 
 load_dotenv()
 
@@ -15,6 +28,13 @@ API_BASE_URL = "https://api.agendor.com.br/v3"
 API_URL = f"{API_BASE_URL}/deals"
 API_TOKEN = os.getenv("API_TOKEN") or ""
 API_AUTH_HEADER = {"Authorization": f"Token {API_TOKEN}"}
+# Fuso em que os dias e meses de venda sao contados. Datas da API (UTC ou com
+# offset) e do espelho (fuso da sessao do Postgres) sao convertidas para ele.
+LOCAL_TIMEZONE = ZoneInfo(os.getenv("AGENDOR_TIMEZONE", "America/Sao_Paulo"))
+
+
+def local_today():
+    return datetime.now(LOCAL_TIMEZONE).date()
 
 
 def _parse_retry_after(value):
@@ -33,85 +53,305 @@ def _parse_retry_after(value):
             return None
 
 
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+PRIORITY_BULK = 2
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_BACKGROUND: "background",
+    PRIORITY_BULK: "bulk",
+}
+
+
+def _parse_header_float(headers, *names):
+    for name in names:
+        value = headers.get(name)
+        if value in (None, ""):
+            continue
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
 class RateLimiter:
-    def __init__(self, rate_per_second=3):
-        self._interval = 1.0 / rate_per_second
-        self._lock = threading.Lock()
-        self._last_call = 0.0
+    """Token bucket global com taxa adaptativa.
+
+    Acumula ate `burst` fichas quando ocioso, reduz a taxa pela metade a cada
+    429 e volta a subir aos poucos a cada resposta bem-sucedida, sem passar de
+    `max_rate`. Quando ha varias threads esperando, a de maior prioridade
+    (menor numero) sempre fica com a proxima ficha. O lock nunca e mantido
+    durante a espera.
+    """
+
+    def __init__(self, rate_per_second=3, burst=1, min_rate=0.5, max_rate=None, increase_step=0.02):
+        self._rate = float(rate_per_second)
+        self._min_rate = float(min_rate)
+        self._max_rate = float(max_rate or rate_per_second)
+        self._increase_step = increase_step
+        self._burst = max(1, int(burst))
+        self._tokens = float(self._burst)
+        self._updated = time.monotonic()
         self._blocked_until = 0.0
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._seq = itertools.count()
 
-    def wait_for_slot(self):
-        with self._lock:
-            now = time.monotonic()
-            if now < self._blocked_until:
-                time.sleep(self._blocked_until - now)
-                now = time.monotonic()
-            next_allowed = self._last_call + self._interval
-            if now < next_allowed:
-                time.sleep(next_allowed - now)
-                now = time.monotonic()
-            self._last_call = now
+    @property
+    def rate(self):
+        return self._rate
+
+    def state(self):
+        with self._cond:
+            self._refill(time.monotonic())
+            return {
+                "rate": round(self._rate, 3),
+                "max_rate": self._max_rate,
+                "burst": self._burst,
+                "tokens": round(self._tokens, 2),
+                "blocked_for": round(max(0.0, self._blocked_until - time.monotonic()), 2),
+            }
+
+    def _refill(self, now):
+        if now > self._updated:
+            self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+
+    def wait_for_slot(self, priority=PRIORITY_INTERACTIVE):
+        ticket = (priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    if self._waiters[0] != ticket:
+                        self._cond.wait()
+                        continue
+                    now = time.monotonic()
+                    if now < self._blocked_until:
+                        self._cond.wait(self._blocked_until - now)
+                        continue
+                    self._refill(now)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    self._cond.wait((1 - self._tokens) / self._rate)
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
 
     def block_for(self, delay):
         if delay <= 0:
             return
-        with self._lock:
+        with self._cond:
+            self._block(time.monotonic(), delay)
+
+    def on_rate_limited(self, delay):
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            # Os 429 de uma mesma rajada chegam dentro do bloqueio aberto pelo
+            # primeiro: a taxa cai pela metade uma vez por janela, nao por worker.
+            if now >= self._blocked_until:
+                self._rate = max(self._min_rate, self._rate / 2)
+            if delay > 0:
+                self._block(now, delay)
+
+    def _block(self, now, delay):
+        # Chamado com o lock.
+        self._blocked_until = max(self._blocked_until, now + delay)
+        # Depois de um bloqueio nao faz sentido gastar o burst acumulado de uma vez.
+        self._refill(now)
+        self._tokens = 0.0
+        self._updated = max(self._updated, self._blocked_until)
+        self._cond.notify_all()
+
+    def on_success(self, headers=None):
+        with self._cond:
             now = time.monotonic()
-            blocked_until = now + delay
-            if blocked_until > self._blocked_until:
-                self._blocked_until = blocked_until
+            self._refill(now)
+            self._rate = min(self._max_rate, self._rate + self._increase_step)
+            if headers:
+                self._apply_headers(headers, now)
+            self._cond.notify_all()
+
+    def _apply_headers(self, headers, now):
+        limit = _parse_header_float(headers, "X-RateLimit-Limit")
+        remaining = _parse_header_float(headers, "X-RateLimit-Remaining")
+        reset = _parse_header_float(headers, "X-RateLimit-Reset")
+        if reset is not None and reset > 1e9:
+            # Alguns servidores mandam o instante do reset (epoch) em vez de segundos.
+            reset = reset - time.time()
+
+        if remaining is None or reset is None or reset <= 0:
+            return
+        if remaining <= 0:
+            self._blocked_until = max(self._blocked_until, now + reset)
+            self._tokens = 0.0
+            return
+        # Distribui o que resta da janela ate o reset em vez de esgota-lo em rajada.
+        sustainable = remaining / reset
+        if limit is not None and remaining >= limit:
+            return
+        if sustainable < self._rate:
+            self._rate = max(self._min_rate, sustainable)
 
 
 class _QueuedRequest:
-    def __init__(self, method, url, kwargs):
+    def __init__(self, method, url, kwargs, priority):
         self.method = method
         self.url = url
         self.kwargs = kwargs
+        self.priority = priority
         self.response = None
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
         self.done = threading.Event()
+        self._claim_lock = threading.Lock()
+        self._claimed = False
+
+    def claim(self):
+        """Interativas entram em duas filas; so o primeiro worker a pegar executa."""
+        with self._claim_lock:
+            if self._claimed:
+                return False
+            self._claimed = True
+            return True
+
+
+class _PriorityStats:
+    def __init__(self):
+        self.queued = 0
+        self.served = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
 
 
 class AgendorAPIClient:
-    def __init__(self, rate_per_second=3, max_connections=4, max_retries=6):
+    def __init__(self, rate_per_second=3, max_connections=4, max_retries=6, max_workers=None, burst=1, max_rate=None,
+                 interactive_workers=1):
         self._session = requests.Session()
-        adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections, pool_block=True)
+        # Conexoes extras para os workers reservados: eles nao podem esperar
+        # por uma conexao presa em pagina de lote.
+        pool_size = max_connections + interactive_workers
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
         self._session.mount("https://", adapter)
         self._session.mount("http://", adapter)
 
-        self._rate_limiter = RateLimiter(rate_per_second=rate_per_second)
+        self._rate_limiter = RateLimiter(rate_per_second=rate_per_second, burst=burst, max_rate=max_rate)
         self._max_retries = max_retries
-        self._queue = Queue()
-        self._worker = threading.Thread(target=self._run, daemon=True)
-        self._worker.start()
+        self._queue = PriorityQueue()
+        self._interactive_queue = Queue()
+        self._seq = itertools.count()
+        self._context = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats = {priority: _PriorityStats() for priority in PRIORITY_NAMES}
+        # Por padrao um worker por conexao do pool: o limite de taxa continua
+        # global, mas requisicoes em paralelo nao ficam presas a latencia umas
+        # das outras.
+        self.max_workers = max_workers or max_connections
+        self._workers = [threading.Thread(target=self._run, daemon=True) for _ in range(self.max_workers)]
+        # Workers reservados so atendem requisicoes interativas: mesmo com todos
+        # os outros ocupados em paginas de lote, a tela pega a proxima ficha.
+        self._workers += [
+            threading.Thread(target=self._run_interactive, daemon=True) for _ in range(interactive_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    @contextmanager
+    def priority(self, priority):
+        """Define a classe padrao das requisicoes feitas pela thread atual."""
+        previous = getattr(self._context, "priority", PRIORITY_INTERACTIVE)
+        self._context.priority = priority
+        try:
+            yield
+        finally:
+            self._context.priority = previous
 
-    def request(self, method, url, **kwargs):
-        item = _QueuedRequest(method, url, kwargs)
-        self._queue.put(item)
+    @property
+    def current_priority(self):
+        """Classe padrao da thread atual, para repassar a threads auxiliares."""
+        return getattr(self._context, "priority", PRIORITY_INTERACTIVE)
+
+    def submit(self, method, url, priority=None, **kwargs):
+        if priority is None:
+            priority = self.current_priority
+        item = _QueuedRequest(method, url, kwargs, priority)
+        with self._stats_lock:
+            self._stats[priority].queued += 1
+        self._queue.put((priority, next(self._seq), item))
+        if priority == PRIORITY_INTERACTIVE:
+            self._interactive_queue.put(item)
+        return item
+
+    def request(self, method, url, priority=None, **kwargs):
+        item = self.submit(method, url, priority=priority, **kwargs)
         item.done.wait()
         return item.response
 
+    def rate_limit_state(self):
+        return self._rate_limiter.state()
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                PRIORITY_NAMES[priority]: {
+                    "queue_depth": stats.queued,
+                    "served": stats.served,
+                    "avg_wait": round(stats.total_wait / stats.served, 3) if stats.served else 0.0,
+                    "max_wait": round(stats.max_wait, 3),
+                }
+                for priority, stats in self._stats.items()
+            }
+
     def _run(self):
         while True:
-            item = self._queue.get()
-            try:
-                item.response = self._send_with_retries(item.method, item.url, **item.kwargs)
-            except Exception as exc:
-                print(f"[Agendor] erro no worker de requests: {exc}")
-                item.response = None
-            finally:
-                item.done.set()
-                self._queue.task_done()
+            _, _, item = self._queue.get()
+            self._execute(item)
+            self._queue.task_done()
+
+    def _run_interactive(self):
+        while True:
+            item = self._interactive_queue.get()
+            self._execute(item)
+            self._interactive_queue.task_done()
+
+    def _execute(self, item):
+        if not item.claim():
+            return
+        with self._stats_lock:
+            self._stats[item.priority].queued -= 1
+        try:
+            item.response = self._send_with_retries(item)
+        except Exception as exc:
+            print(f"[Agendor] erro no worker de requests: {exc}")
+            item.response = None
+        finally:
+            self._record_wait(item)
+            item.done.set()
+
+    def _record_wait(self, item):
+        wait = (item.started_at or time.monotonic()) - item.enqueued_at
+        with self._stats_lock:
+            stats = self._stats[item.priority]
+            stats.served += 1
+            stats.total_wait += wait
+            stats.max_wait = max(stats.max_wait, wait)
 
-    def _send_with_retries(self, method, url, **kwargs):
+    def _send_with_retries(self, item):
         backoff = 0.6
         max_backoff = 8
         attempt = 0
 
         while attempt < self._max_retries:
             attempt += 1
-            self._rate_limiter.wait_for_slot()
+            self._rate_limiter.wait_for_slot(item.priority)
+            if item.started_at is None:
+                item.started_at = time.monotonic()
             try:
-                response = self._session.request(method, url, **kwargs)
+                response = self._session.request(item.method, item.url, **item.kwargs)
             except requests.RequestException as exc:
                 print(f"[Agendor] tentativa {attempt} falhou: {exc}")
                 if attempt >= self._max_retries:
@@ -125,8 +365,9 @@ class AgendorAPIClient:
                 delay = retry_delay if retry_delay is not None else backoff
                 delay = max(delay, backoff)
                 print(f"[Agendor] 429 recebido, aguardando {delay:.1f}s (tentativa {attempt})")
-                self._rate_limiter.block_for(delay)
-                time.sleep(delay)
+                # O bloqueio no limitador ja segura a proxima tentativa (e todas as
+                # outras threads); o worker nao precisa dormir por conta propria.
+                self._rate_limiter.on_rate_limited(delay)
                 backoff = min(backoff * 2, max_backoff)
                 continue
 
@@ -136,13 +377,22 @@ class AgendorAPIClient:
                 backoff = min(backoff * 2, max_backoff)
                 continue
 
+            self._rate_limiter.on_success(response.headers)
             return response
 
         print("[Agendor] excedido limite de tentativas")
         return None
 
 
-AGENDOR_CLIENT = AgendorAPIClient(rate_per_second=3, max_connections=4, max_retries=6)
+AGENDOR_CLIENT = AgendorAPIClient(
+    rate_per_second=float(os.getenv("AGENDOR_RATE", "3")),
+    max_rate=float(os.getenv("AGENDOR_MAX_RATE", "8")),
+    burst=int(os.getenv("AGENDOR_BURST", "5")),
+    max_connections=4,
+    max_retries=6,
+    max_workers=int(os.getenv("AGENDOR_MAX_WORKERS", "4")),
+    interactive_workers=int(os.getenv("AGENDOR_INTERACTIVE_WORKERS", "1")),
+)
 
 ano_atual = datetime.now().year
 mes_atual = datetime.now().month
@@ -184,60 +434,474 @@ meses = {
 }
 
 
-def fetch_deal_data(params):
-    """Busca negocios com paginacao simples usando /deals/stream."""
-    all_data = []
-    current_page = 1
+class AgendorAPIError(Exception):
+    pass
+
+
+def _submit_page(url, base_params, page, per_page, headers, priority=None):
+    query_params = {**base_params, "page": page, "per_page": per_page}
+    return AGENDOR_CLIENT.submit("GET", url, priority=priority, headers=headers, params=query_params, timeout=20)
+
+
+def _read_page(item, label, page, strict):
+    item.done.wait()
+    response = item.response
+    if not response or response.status_code != 200:
+        status = response.status_code if response is not None else "sem resposta"
+        detalhe = response.text if response is not None else ""
+        print(f"Erro da API Agendor ({label}): {status} | {detalhe}")
+        if strict:
+            raise AgendorAPIError(f"{label}: pagina {page} falhou ({status})")
+        return None
+    return response.json()
+
+
+def _has_next_page(data):
+    links = data.get("links") or {}
+    meta = data.get("meta") or {}
+    return bool(links.get("next")) or bool(meta.get("hasNextPage"))
+
+
+def _paginate(url, params, label, headers=None, per_page=100, delay=0.0, strict=False, parallel=True, count=None, priority=None):
+    """Percorre as paginas de um endpoint do Agendor devolvendo os registros de cada pagina.
+
+    Em modo paralelo o total de paginas vem do `meta.totalCount` da primeira
+    resposta (ou de `count()`), e as paginas seguintes sao disparadas juntas no
+    pool do cliente; os registros continuam saindo na ordem das paginas.
+    """
     base_params = dict(params or {})
-    url = f"{API_URL}/stream"
+    base_params.pop("page", None)
+    base_params.pop("per_page", None)
+    headers = headers or API_AUTH_HEADER
+
+    data = _read_page(_submit_page(url, base_params, 1, per_page, headers, priority), label, 1, strict)
+    if data is None:
+        return
+    registros = data.get("data") or []
+    if not registros:
+        return
+    print(f"[{label}] {len(registros)} registros carregados (pagina 1)")
+    yield registros
+
+    last_page = None
+    if parallel and _has_next_page(data):
+        total = (data.get("meta") or {}).get("totalCount")
+        if total is None and count is not None:
+            total = count()
+        if total:
+            last_page = math.ceil(total / per_page)
 
-    while True:
-        query_params = {**base_params, "page": current_page, "per_page": 100}
-        response = AGENDOR_CLIENT.request("GET", url, headers=API_AUTH_HEADER, params=query_params, timeout=20)
-        if not response:
-            break
+    window = AGENDOR_CLIENT.max_workers * 2
+    pending = deque()
+    next_page = 2
+    while pending or _has_next_page(data):
+        if last_page is not None:
+            while next_page <= last_page and len(pending) < window:
+                pending.append((next_page, _submit_page(url, base_params, next_page, per_page, headers, priority)))
+                next_page += 1
 
-        if response.status_code != 200:
-            print(f"Erro da API Agendor (deals): {response.status_code} | {response.text}")
-            break
+        if pending:
+            page, item = pending.popleft()
+        else:
+            # Sem total conhecido (ou total desatualizado): segue pagina a pagina.
+            if delay and last_page is None:
+                time.sleep(delay)
+            page = next_page
+            next_page += 1
+            item = _submit_page(url, base_params, page, per_page, headers, priority)
 
-        data = response.json()
+        data = _read_page(item, label, page, strict)
+        if data is None:
+            return
         registros = data.get("data") or []
         if not registros:
-            break
+            return
+        print(f"[{label}] {len(registros)} registros carregados (pagina {page})")
+        yield registros
+
+
+@lru_cache(maxsize=8192)
+def _parse_dt_text(s):
+    # Caminho rapido para o ISO-8601 que o Agendor devolve ("2024-05-10T14:32:11.000Z");
+    # o parser generico do dateutil fica so como fallback para formatos inesperados.
+    texto = s.strip()
+    if texto[-1:] in ("Z", "z"):
+        texto = texto[:-1] + "+00:00"
+    try:
+        return datetime.fromisoformat(texto)
+    except ValueError:
+        pass
+    try:
+        return dateutil_parser.parse(s)
+    except (ValueError, OverflowError):
+        return None
+
+
+def parse_dt_safe(s):
+    if isinstance(s, datetime):
+        return s
+    if not s or not isinstance(s, str) or not s.strip():
+        return None
+    return _parse_dt_text(s)
 
+
+def _parse_api_datetime(value):
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        parsed = parse_dt_safe(value)
+    if parsed is None:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(LOCAL_TIMEZONE)
+
+
+def _as_utc(value):
+    return value.astimezone(timezone.utc) if value is not None else None
+
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass(frozen=True, slots=True)
+class Deal:
+    """Negocio normalizado: valor ja em float, dono com id inteiro e data de
+    ganho (endTime) convertida uma unica vez para datetime em LOCAL_TIMEZONE."""
+
+    id: int
+    nome: str
+    valor: float
+    etapa_id: int | None
+    etapa: str | None
+    funil: str | None
+    status: str | None
+    consultor_id: int | None
+    consultor: str
+    data_ganho: datetime | None
+
+
+@dataclass(frozen=True, slots=True)
+class Task:
+    id: int
+    tipo: str
+    titulo: str
+    data: datetime | None
+    finalizada_em: datetime | None
+    concluida: bool
+    deal_id: int | None
+    consultor_id: int | None
+    consultor: str
+
+
+def _remap_deal(registro):
+    owner = registro.get("owner")
+    owner = owner if isinstance(owner, dict) else {}
+    deal_stage = registro.get("dealStage") or {}
+    funnel = deal_stage.get("funnel") or {}
+    deal_status = registro.get("dealStatus") or {}
+
+    return Deal(
+        id=_as_int(registro.get("id")),
+        nome=registro.get("name") or registro.get("title") or (registro.get("deal") or {}).get("name") or f"Negócio #{registro.get('id')}",
+        valor=float(registro.get("value", 0) or 0),
+        etapa_id=_as_int(deal_stage.get("id")),
+        etapa=deal_stage.get("name"),
+        funil=funnel.get("name"),
+        status=deal_status.get("name"),
+        consultor_id=_as_int(owner.get("id")),
+        consultor=owner.get("name", "Sem consultor"),
+        data_ganho=_parse_api_datetime(registro.get("endTime")),
+    )
+
+
+def _iter_deal_api(params):
+    count = lambda: _fetch_total_count(API_URL, params, "deals-count")
+    for registros in _paginate(f"{API_URL}/stream", params, "deals", delay=0.2, count=count):
         for registro in registros:
-            owner = registro.get("owner") or {}
-            deal_stage = registro.get("dealStage") or {}
-            funnel = deal_stage.get("funnel") or {}
-            deal_status = registro.get("dealStatus") or {}
-
-            all_data.append({
-                    "ID": registro.get("id"),
-                    "Valor do Negócio": registro.get("value", 0) or 0,
-                    "EtapaId": deal_stage.get("id"),
-                    "Etapa": deal_stage.get("name"),
-                    "Funil": funnel.get("name"),
-                    "Status": deal_status.get("name"),
-                    "ConsultorId": owner.get("id") if isinstance(owner, dict) else None,
-                    "Consultor": owner.get("name", "Sem consultor") if isinstance(owner, dict) else "Sem consultor",
-                    "Data Final": registro.get("endTime"),
-                    "Data Ganho": registro.get("endTime"),
-                    "Nome": registro.get("name") or registro.get("title") or (registro.get("deal") or {}).get("name") or f"Negócio #{registro.get('id')}",
-                })
-
-        print(f"[deals] {len(registros)} registros carregados (pagina {current_page})")
-
-        links = data.get("links") or {}
-        meta = data.get("meta") or {}
-        has_next = bool(links.get("next")) or bool(meta.get("hasNextPage"))
-        if not has_next:
-            break
-
-        current_page += 1
-        time.sleep(0.2)
-
-    return all_data
+            yield _remap_deal(registro)
+
+
+# Espelho local dos negocios: a sincronizacao busca apenas o que mudou desde o
+# ultimo watermark (updatedAt) e as leituras passam a ser consultas no banco.
+# Quem sincroniza e a tarefa periodica do app (a cada DEAL_SYNC_INTERVAL, so no
+# lider); a leitura so sincroniza quando o espelho nunca foi preenchido.
+DEAL_STORE_RESOURCE = "deals"
+DEAL_STORE_PARAMS = {"page", "per_page", "dealStatus", "since"}
+DEAL_SYNC_INTERVAL = float(os.getenv("AGENDOR_DEAL_SYNC_INTERVAL", "60"))
+DEAL_SYNC_OVERLAP = timedelta(minutes=5)
+# A carga completa periodica e o que detecta negocios excluidos no Agendor.
+DEAL_RECONCILE_INTERVAL = float(os.getenv("AGENDOR_DEAL_RECONCILE_INTERVAL", "86400"))
+
+_deal_sync_lock = threading.Lock()
+
+
+def _deal_store_values(registro):
+    deal = _remap_deal(registro)
+    deal_status = registro.get("dealStatus") or {}
+    return {
+        "id": deal.id,
+        "nome": deal.nome,
+        "valor": deal.valor,
+        "etapa_id": deal.etapa_id,
+        "etapa": deal.etapa,
+        "funil": deal.funil,
+        "status_id": _as_int(deal_status.get("id")),
+        "status": deal.status,
+        "consultor_id": deal.consultor_id,
+        "consultor": deal.consultor,
+        # Gravado em UTC: a leitura converte de volta para LOCAL_TIMEZONE.
+        "data_final": _as_utc(deal.data_ganho),
+        "atualizado_em": _as_utc(_parse_api_datetime(registro.get("updatedAt"))),
+    }
+
+
+def deal_store_ready():
+    """True depois que o espelho completou ao menos uma sincronizacao."""
+    ultima_execucao = db.session.query(SincronizacaoAgendor.ultima_execucao).filter(
+        SincronizacaoAgendor.recurso == DEAL_STORE_RESOURCE
+    ).scalar()
+    return ultima_execucao is not None
+
+
+def sync_deal_store(full=False):
+    """Atualiza o espelho local com os negocios alterados desde o ultimo watermark.
+
+    Com `full=True` refaz a janela desde o inicio do ano e remove do espelho os
+    negocios que nao vieram e que o Agendor confirma terem sido excluidos.
+    """
+    with _deal_sync_lock:
+        estado = db.session.get(SincronizacaoAgendor, DEAL_STORE_RESOURCE)
+        if estado is None:
+            estado = SincronizacaoAgendor(recurso=DEAL_STORE_RESOURCE)
+            db.session.add(estado)
+
+        watermark = None if full else estado.watermark
+        if watermark is not None and watermark.tzinfo is None:
+            watermark = watermark.replace(tzinfo=timezone.utc)
+        since = (watermark - DEAL_SYNC_OVERLAP).isoformat() if watermark else primeiro_dia_ano
+
+        agora = datetime.now(timezone.utc)
+        maior_atualizacao = watermark
+        total = 0
+        vistos = set()
+        try:
+            # A carga completa e trabalho de lote: nao pode atrasar as telas.
+            priority = PRIORITY_BULK if full else None
+            count = lambda: _fetch_total_count(API_URL, {"since": since}, "deals-count", priority=priority)
+            paginas = _paginate(f"{API_URL}/stream", {"since": since}, "deals-sync", strict=True, count=count, priority=priority)
+            for registros in paginas:
+                valores = [_deal_store_values(registro) for registro in registros]
+                valores = [v for v in valores if v["id"] is not None]
+                existentes = {
+                    negocio.id: negocio
+                    for negocio in NegocioAgendor.query.filter(NegocioAgendor.id.in_([v["id"] for v in valores]))
+                }
+                for v in valores:
+                    negocio = existentes.get(v["id"])
+                    if negocio is None:
+                        negocio = NegocioAgendor(id=v["id"])
+                        db.session.add(negocio)
+                        existentes[v["id"]] = negocio
+                    for campo, valor in v.items():
+                        setattr(negocio, campo, valor)
+                    negocio.sincronizado_em = agora
+                    atualizado = v["atualizado_em"]
+                    if atualizado and (maior_atualizacao is None or atualizado > maior_atualizacao):
+                        maior_atualizacao = atualizado
+                total += len(valores)
+                vistos.update(v["id"] for v in valores)
+                db.session.commit()
+        except AgendorAPIError as exc:
+            # Mantem o watermark anterior: a proxima sincronizacao repete a janela.
+            print(f"[deals-sync] sincronizacao incompleta: {exc}")
+            db.session.commit()
+            return total
+        except IntegrityError:
+            # Outro processo preencheu os mesmos negocios ao mesmo tempo (so
+            # acontece na primeira carga); a proxima sincronizacao continua.
+            db.session.rollback()
+            print("[deals-sync] outro processo esta sincronizando o espelho; tentando depois.")
+            return total
+
+        estado.watermark = maior_atualizacao
+        estado.ultima_execucao = agora
+        db.session.commit()
+        removidos = _purge_deleted_deals(vistos, since) if full else 0
+        if total or removidos:
+            invalidate_deal_snapshots()
+        print(f"[deals-sync] {total} negocios sincronizados desde {since}")
+        return total
+
+
+def _purge_deleted_deals(seen_ids, since):
+    """Remove do espelho os negocios da janela que nao vieram na carga completa.
+
+    Uma pagina pode pular registros se algo mudar durante a paginacao, entao
+    cada ausente so e removido se o Agendor responder 404 para ele.
+    """
+    desde = _parse_api_datetime(since)
+    ausentes = [
+        deal_id for (deal_id,) in db.session.query(NegocioAgendor.id).filter(NegocioAgendor.atualizado_em >= desde)
+        if deal_id not in seen_ids
+    ]
+    excluidos = []
+    for deal_id in ausentes:
+        response = AGENDOR_CLIENT.request(
+            "GET", f"{API_URL}/{deal_id}", priority=PRIORITY_BULK, headers=API_AUTH_HEADER, timeout=20
+        )
+        if response is not None and response.status_code == 404:
+            excluidos.append(deal_id)
+    if excluidos:
+        NegocioAgendor.query.filter(NegocioAgendor.id.in_(excluidos)).delete(synchronize_session=False)
+        db.session.commit()
+        print(f"[deals-sync] {len(excluidos)} negocios excluidos no Agendor removidos do espelho")
+    return len(excluidos)
+
+
+def _deal_from_store(negocio):
+    return Deal(
+        id=negocio.id,
+        nome=negocio.nome or f"Negócio #{negocio.id}",
+        valor=float(negocio.valor or 0),
+        etapa_id=negocio.etapa_id,
+        etapa=negocio.etapa,
+        funil=negocio.funil,
+        status=negocio.status,
+        consultor_id=negocio.consultor_id,
+        consultor=negocio.consultor or "Sem consultor",
+        data_ganho=_parse_api_datetime(negocio.data_final),
+    )
+
+
+def _deal_store_query(params):
+    query = NegocioAgendor.query
+    status = _as_int(params.get("dealStatus"))
+    if status is not None:
+        query = query.filter(NegocioAgendor.status_id == status)
+    since = _parse_api_datetime(params.get("since"))
+    if since is not None:
+        query = query.filter(NegocioAgendor.atualizado_em >= since)
+    return query.order_by(NegocioAgendor.id)
+
+
+def _iter_deal_source(params):
+    if not has_app_context() or not set(params) <= DEAL_STORE_PARAMS:
+        yield from _iter_deal_api(params)
+        return
+    try:
+        if not deal_store_ready():
+            sync_deal_store()
+        if not deal_store_ready():
+            # Primeira carga feita por outro processo e ainda nao concluida.
+            yield from _iter_deal_api(params)
+            return
+        negocios = iter(_deal_store_query(params).yield_per(100))
+        primeiro = next(negocios, None)
+    except SQLAlchemyError as exc:
+        print(f"⚠️ Espelho de negocios indisponivel, consultando a API: {exc}")
+        db.session.rollback()
+        yield from _iter_deal_api(params)
+        return
+    if primeiro is None:
+        return
+    yield _deal_from_store(primeiro)
+    for negocio in negocios:
+        yield _deal_from_store(negocio)
+
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SnapshotCache:
+    """Reaproveita resultados por chave durante `ttl` segundos e junta chamadas
+    concorrentes para a mesma chave numa unica busca (single-flight)."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._inflight = {}
+
+    def get(self, key, loader):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() < entry[0]:
+                return entry[1]
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _InFlight()
+                self._inflight[key] = flight
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+        except Exception as exc:
+            flight.error = exc
+            raise
+        else:
+            with self._lock:
+                self._entries[key] = (time.monotonic() + self.ttl, flight.value)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+        return flight.value
+
+    def peek(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() < entry[0]:
+                return entry[1]
+            return None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+DEAL_SNAPSHOT_TTL = float(os.getenv("AGENDOR_DEAL_SNAPSHOT_TTL", "30"))
+_deal_snapshots = SnapshotCache(ttl=DEAL_SNAPSHOT_TTL)
+
+
+def _params_key(params):
+    return tuple(sorted((str(k), str(v)) for k, v in params.items()))
+
+
+def invalidate_deal_snapshots():
+    _deal_snapshots.clear()
+
+
+def fetch_deal_data(params):
+    """Busca negocios no espelho local, sincronizando antes apenas o que mudou no Agendor.
+
+    Chamadas com os mesmos parametros dentro de DEAL_SNAPSHOT_TTL compartilham o
+    mesmo snapshot (uma tupla que nao deve ser modificada pelos chamadores)."""
+    params = dict(params or {})
+    return _deal_snapshots.get(_params_key(params), lambda: tuple(_iter_deal_source(params)))
+
+
+def iter_deals(params):
+    """Gera os negocios um a um para os redutores.
+
+    Passa pelo mesmo single-flight de fetch_deal_data: chamadas concorrentes
+    com os mesmos parametros esperam um unico snapshot em vez de paginar cada
+    uma a sua."""
+    yield from fetch_deal_data(params)
 
 
 def _normalize_assigned_user(assigned_users, user):
@@ -254,63 +918,228 @@ def _normalize_assigned_user(assigned_users, user):
     return consultor_id, consultor_nome
 
 
-def fetch_tasks(params):
-    """Busca tarefas com paginacao controlada e filtros dinamicos."""
-    all_tasks = []
+def _remap_task(registro):
+    consultor_id, consultor_nome = _normalize_assigned_user(
+        registro.get("assignedUsers"),
+        registro.get("user"),
+    )
+    return Task(
+        id=_as_int(registro.get("id")),
+        # Nome como cadastrado no Agendor: e o valor aceito pelo filtro `type`.
+        tipo=registro.get("type") or "",
+        titulo=registro.get("text") or registro.get("title") or "",
+        data=_parse_api_datetime(registro.get("dueDate") or registro.get("datetime") or registro.get("date")),
+        finalizada_em=_parse_api_datetime(registro.get("finishedAt")),
+        concluida=bool(registro.get("finishedAt")),
+        deal_id=_as_int((registro.get("deal") or {}).get("id")),
+        consultor_id=_as_int(consultor_id),
+        consultor=consultor_nome or "Desconhecido",
+    )
+
+
+def iter_tasks(params):
+    """Gera as tarefas pagina a pagina, sem montar a lista inteira."""
     base_params = dict(params or {})
     per_page = min(100, max(1, int(base_params.pop("per_page", 100) or 100)))
-    page = 1
 
-    while True:
-        query_params = {"page": page, "per_page": per_page, **base_params}
-        response = AGENDOR_CLIENT.request(
-            "GET",
-            f"{API_BASE_URL}/tasks",
-            headers={**API_AUTH_HEADER, "Content-Type": "application/json"},
-            params=query_params,
-            timeout=20,
-        )
-        if not response:
-            break
+    for registros in _paginate(
+        f"{API_BASE_URL}/tasks",
+        base_params,
+        "tasks",
+        headers={**API_AUTH_HEADER, "Content-Type": "application/json"},
+        per_page=per_page,
+        delay=0.4,
+    ):
+        for registro in registros:
+            yield _remap_task(registro)
 
-        if response.status_code != 200:
-            print(f"Erro da API Agendor (tasks): {response.status_code} | {response.text}")
-            break
 
-        data = response.json()
-        registros = data.get("data") or []
+def count_tasks(params):
+    """Quantidade de tarefas para os filtros, lida do `meta.totalCount` de uma
+    pagina com um unico registro.
 
-        for registro in registros:
-            consultor_id, consultor_nome = _normalize_assigned_user(
-                registro.get("assignedUsers"),
-                registro.get("user"),
-            )
-            task_type = (registro.get("type") or "").upper()
-
-            all_tasks.append({
-                "ID": registro.get("id"),
-                "Tipo": task_type,
-                "Titulo": registro.get("text") or registro.get("title") or "",
-                "Data": registro.get("dueDate") or registro.get("datetime") or registro.get("date"),
-                "FinalizadaEm": registro.get("finishedAt"),
-                "Concluida": bool(registro.get("finishedAt")),
-                "DealId": (registro.get("deal") or {}).get("id"),
-                "ConsultorId": consultor_id,
-                "Consultor": consultor_nome or "Desconhecido",
+    Devolve None se a API falhar ou nao informar o total; quem chama decide se
+    cai para a paginacao completa de iter_tasks.
+    """
+    base_params = dict(params or {})
+    base_params.pop("page", None)
+    base_params.pop("per_page", None)
+    return _fetch_total_count(
+        f"{API_BASE_URL}/tasks",
+        base_params,
+        "tasks-count",
+        headers={**API_AUTH_HEADER, "Content-Type": "application/json"},
+    )
+
+
+# Redutores de uma passada: cada um consome os registros de iter_deals/iter_tasks
+# sem guardar a lista, e reduce_records alimenta varios deles ao mesmo tempo.
+class Sum:
+    def __init__(self, value, where=None):
+        self._value = value
+        self._where = where
+        self.result = 0.0
+
+    def add(self, record):
+        if self._where is None or self._where(record):
+            self.result += float(self._value(record) or 0)
+
+
+class SumBy:
+    """Soma agrupada: {chave: total}."""
+
+    def __init__(self, key, value, where=None):
+        self._key = key
+        self._value = value
+        self._where = where
+        self.result = {}
+
+    def add(self, record):
+        if self._where is None or self._where(record):
+            key = self._key(record)
+            self.result[key] = self.result.get(key, 0.0) + float(self._value(record) or 0)
+
+
+class Collect:
+    def __init__(self, where=None):
+        self._where = where
+        self.result = []
+
+    def add(self, record):
+        if self._where is None or self._where(record):
+            self.result.append(record)
+
+
+class Count:
+    def __init__(self, where=None):
+        self._where = where
+        self.result = 0
+
+    def add(self, record):
+        if self._where is None or self._where(record):
+            self.result += 1
+
+
+class TopN:
+    def __init__(self, n, key, where=None):
+        self._n = n
+        self._key = key
+        self._where = where
+        self._heap = []
+        self._seq = itertools.count()
+
+    def add(self, record):
+        if self._where is not None and not self._where(record):
+            return
+        entry = (self._key(record), next(self._seq), record)
+        if len(self._heap) < self._n:
+            heapq.heappush(self._heap, entry)
+        elif entry[0] > self._heap[0][0]:
+            heapq.heapreplace(self._heap, entry)
+
+    @property
+    def result(self):
+        return [record for _, _, record in sorted(self._heap, key=lambda e: (e[0], -e[1]), reverse=True)]
+
+
+class MaxBy:
+    def __init__(self, key, where=None):
+        self._key = key
+        self._where = where
+        self._best = None
+        self.result = None
+
+    def add(self, record):
+        if self._where is not None and not self._where(record):
+            return
+        value = self._key(record)
+        if value is None:
+            return
+        if self._best is None or value > self._best:
+            self._best = value
+            self.result = record
+
+
+def reduce_records(records, **reducers):
+    """Percorre `records` uma unica vez alimentando todos os redutores informados."""
+    for record in records:
+        for reducer in reducers.values():
+            reducer.add(record)
+    return {name: reducer.result for name, reducer in reducers.items()}
+
+
+class SalesAggregator:
+    """Consolida um snapshot de negocios ganhos numa unica passada de redutores.
+
+    Guarda os totais do ano e do mes de referencia, os negocios do mes, a
+    ultima venda, o ranking por consultor (com os negocios de cada um) e os
+    totais por dia, que permitem somar qualquer janela de campanha sem
+    percorrer os negocios de novo.
+    """
+
+    def __init__(self, deals, hoje=None):
+        hoje = hoje or local_today()
+        self.ano = hoje.year
+        self.mes = hoje.month
+
+        def no_ano(deal):
+            return deal.data_ganho.year == self.ano
+
+        def no_mes(deal):
+            return no_ano(deal) and deal.data_ganho.month == self.mes
+
+        valor = lambda deal: deal.valor
+        resultado = reduce_records(
+            (deal for deal in deals if deal.data_ganho is not None),
+            vendas_anuais=Sum(valor, where=no_ano),
+            vendas_mes=Sum(valor, where=no_mes),
+            ultima_venda=MaxBy(lambda deal: deal.data_ganho, where=no_mes),
+            negocios_mes=Collect(where=no_mes),
+            por_dia=SumBy(lambda deal: deal.data_ganho.date(), valor),
+        )
+        self.vendas_anuais = resultado["vendas_anuais"]
+        self.vendas_mes = resultado["vendas_mes"]
+        self.ultima_venda = resultado["ultima_venda"]
+        self.negocios_mes = resultado["negocios_mes"]
+        self._por_dia = resultado["por_dia"]
+
+        por_consultor = {}
+        for deal in self.negocios_mes:
+            entry = por_consultor.setdefault(deal.consultor_id, {
+                "consultor_id": deal.consultor_id,
+                "nome": deal.consultor,
+                "total": 0.0,
+                "negocios": [],
             })
+            entry["nome"] = deal.consultor
+            entry["total"] += deal.valor
+            entry["negocios"].append(deal)
+        for entry in por_consultor.values():
+            entry["negocios"].sort(key=lambda d: d.valor, reverse=True)
+        self.por_consultor = sorted(por_consultor.values(), key=lambda c: c["total"], reverse=True)
 
-        print(f"[tasks] {len(registros)} tarefas carregadas (pagina {page})")
+    def total_periodo(self, inicio, fim):
+        return sum(valor for dia, valor in self._por_dia.items() if inicio <= dia <= fim)
 
-        links = data.get("links") or {}
-        meta = data.get("meta") or {}
-        has_next = bool(links.get("next")) or bool(meta.get("hasNextPage"))
-        if not has_next:
-            break
+    def ranking(self, n=None):
+        return self.por_consultor if n is None else self.por_consultor[:n]
 
-        page += 1
-        time.sleep(0.4)
 
-    return all_tasks
+def _fetch_total_count(url, params, label, headers=None, priority=None):
+    query_params = {**dict(params or {}), "page": 1, "per_page": 1}
+    response = AGENDOR_CLIENT.request(
+        "GET",
+        url,
+        priority=priority,
+        headers=headers or API_AUTH_HEADER,
+        params=query_params,
+        timeout=20,
+    )
+    if not response or response.status_code != 200:
+        status = response.status_code if response is not None else "sem resposta"
+        print(f"Erro da API Agendor ({label}): {status}")
+        return None
+    return (response.json().get("meta") or {}).get("totalCount")
 
 
 def fetch_deal_meta(params):
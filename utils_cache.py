@@ -0,0 +1,265 @@
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime, timezone
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, CacheCompartilhado
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem flock, cada processo se considera lider.
+    fcntl = None
+
+
+class _Entry:
+    __slots__ = ("value", "fresh_until", "stale_until", "retry_at", "updated_at", "error")
+
+    def __init__(self, value, ttl, stale_ttl):
+        agora = time.monotonic()
+        self.value = value
+        self.fresh_until = agora + ttl
+        self.stale_until = agora + ttl + stale_ttl
+        self.retry_at = 0.0
+        self.updated_at = datetime.now(timezone.utc)
+        self.error = None
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class StaleWhileRevalidateCache:
+    """Cache por chave com TTL, janela de valor velho e recomputo unico.
+
+    - fresco (idade < ttl): devolve direto;
+    - velho (ate ttl + stale_ttl): devolve o valor velho e recalcula em
+      background, uma thread por chave;
+    - expirado ou ausente: recalcula na hora, e chamadas concorrentes para a
+      mesma chave esperam o mesmo recomputo (single-flight);
+    - se o recomputo falhar, o ultimo valor bom continua sendo servido e a
+      proxima tentativa so acontece depois de `retry_after` segundos.
+
+    `context` (opcional) devolve um context manager aberto em volta dos
+    recomputos em background, para quem precisa de app context ou prioridade.
+    """
+
+    def __init__(self, ttl, stale_ttl=0.0, retry_after=5.0, name="cache", context=None):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.retry_after = retry_after
+        self.name = name
+        self._context = context or nullcontext
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._inflight = {}
+
+    def get(self, key, loader):
+        agora = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if agora < entry.fresh_until:
+                    return entry.value
+                if agora < entry.stale_until or agora < entry.retry_at:
+                    self._start_background(key, loader, entry, agora)
+                    return entry.value
+        return self._load(key, loader)
+
+    def refresh(self, key, loader, strict=False):
+        """Recalcula agora (juntando-se a um recomputo em andamento) e devolve o valor.
+
+        Com `strict=True` a falha e propagada mesmo havendo um valor anterior,
+        para quem agenda o recomputo poder aplicar backoff.
+        """
+        return self._load(key, loader, strict)
+
+    def set(self, key, value, stale=False):
+        """Grava um valor; com `stale=True` ele ja nasce velho, entao o proximo
+        `get` o devolve e dispara o recomputo (warm start)."""
+        entry = _Entry(value, self.ttl, self.stale_ttl)
+        if stale:
+            entry.stale_until -= entry.fresh_until - time.monotonic()
+            entry.fresh_until = time.monotonic()
+        with self._lock:
+            self._entries[key] = entry
+
+    def peek(self, key, allow_stale=True):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if allow_stale or time.monotonic() < entry.fresh_until:
+            return entry.value
+        return None
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def info(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            refreshing = key in self._inflight
+        if entry is None:
+            return {"cached": False, "refreshing": refreshing}
+        agora = time.monotonic()
+        return {
+            "cached": True,
+            "fresh": agora < entry.fresh_until,
+            "updated_at": entry.updated_at.isoformat(),
+            "age": round(self.ttl - (entry.fresh_until - agora), 1),
+            "refreshing": refreshing,
+            "last_error": entry.error,
+        }
+
+    def _start_background(self, key, loader, entry, agora):
+        # Chamado com o lock: so dispara se ninguem ja estiver recalculando e
+        # se a ultima falha nao for recente demais.
+        if key in self._inflight or agora < entry.retry_at:
+            return
+        flight = _Flight()
+        self._inflight[key] = flight
+
+        def run():
+            with self._context():
+                self._run_flight(key, loader, flight)
+
+        threading.Thread(target=run, name=f"{self.name}-refresh", daemon=True).start()
+
+    def _load(self, key, loader, strict=False):
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._inflight[key] = flight
+        if leader:
+            self._run_flight(key, loader, flight)
+        else:
+            flight.done.wait()
+
+        if flight.error is None:
+            return flight.value
+        if strict:
+            raise flight.error
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            raise flight.error
+        return entry.value
+
+    def _run_flight(self, key, loader, flight):
+        try:
+            flight.value = loader()
+        except Exception as exc:
+            flight.error = exc
+            print(f"⚠️ [{self.name}] Falha ao recalcular {key!r}: {exc}")
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry.error = str(exc)
+                    entry.retry_at = time.monotonic() + self.retry_after
+        else:
+            with self._lock:
+                self._entries[key] = _Entry(flight.value, self.ttl, self.stale_ttl)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+
+class SharedCacheStore:
+    """Valores JSON compartilhados entre processos na tabela cache_compartilhado.
+
+    Quem calcula publica com `write`; os demais workers leem com `read` em vez
+    de repetir as chamadas ao Agendor. Falhas de banco viram cache vazio.
+    """
+
+    def read(self, key):
+        """Devolve (valor, idade em segundos) ou None."""
+        try:
+            registro = db.session.query(
+                CacheCompartilhado.valor, CacheCompartilhado.atualizado_em
+            ).filter(CacheCompartilhado.chave == key).first()
+        except SQLAlchemyError as exc:
+            db.session.rollback()
+            print(f"⚠️ [cache] Falha ao ler {key!r} compartilhado: {exc}")
+            return None
+        if registro is None or registro.valor is None:
+            return None
+        atualizado_em = registro.atualizado_em
+        if atualizado_em.tzinfo is None:
+            atualizado_em = atualizado_em.replace(tzinfo=timezone.utc)
+        idade = (datetime.now(timezone.utc) - atualizado_em).total_seconds()
+        return json.loads(registro.valor), idade
+
+    def write(self, key, value):
+        try:
+            db.session.merge(CacheCompartilhado(
+                chave=key,
+                valor=json.dumps(value, default=str),
+                atualizado_em=datetime.now(timezone.utc)
+            ))
+            db.session.commit()
+        except SQLAlchemyError as exc:
+            db.session.rollback()
+            print(f"⚠️ [cache] Falha ao publicar {key!r} compartilhado: {exc}")
+
+
+class LeaderLock:
+    """Eleicao de lider entre processos da mesma maquina com flock.
+
+    O primeiro processo que consegue o lock exclusivo (sem bloquear) vira lider
+    e o segura enquanto viver; quando ele morre o sistema libera o lock e o
+    proximo `acquire` de outro worker assume.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fd = None
+        self._pid = None
+
+    @property
+    def is_leader(self):
+        return self._fd is not None and self._pid == os.getpid()
+
+    def acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Processo filho (fork) herda a copia do estado, nao a lideranca.
+                self._fd = None
+            if self._fd is not None:
+                return True
+            if fcntl is None:
+                self._fd, self._pid = -1, os.getpid()
+                return True
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return False
+            os.ftruncate(fd, 0)
+            os.write(fd, str(os.getpid()).encode())
+            self._fd, self._pid = fd, os.getpid()
+            return True
+
+    def release(self):
+        with self._lock:
+            if self._fd is None or self._pid != os.getpid():
+                return
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+                os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,96 @@
+import hashlib
+import io
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Tamanhos fixos gerados no upload. `recortar` preenche a caixa inteira
+# (avatar quadrado); sem recorte a imagem so e reduzida ate caber na caixa.
+TAMANHOS = {
+    "avatar": {"caixa": (160, 160), "recortar": True},
+    "card": {"caixa": (640, 640), "recortar": False},
+    "banner": {"caixa": (1920, 1080), "recortar": False},
+}
+
+TAMANHOS_POR_TIPO = {
+    "consultor": ("avatar", "card"),
+    "propaganda": ("card", "banner"),
+}
+
+TAMANHO_PADRAO = {
+    "consultor": "avatar",
+    "propaganda": "banner",
+}
+
+QUALIDADE_JPEG = 85
+MAX_PIXELS_ENTRADA = 40_000_000
+
+
+class ImagemInvalida(Exception):
+    pass
+
+
+class Variante:
+    __slots__ = ("tamanho", "conteudo", "mimetype", "largura", "altura", "versao")
+
+    def __init__(self, tamanho, conteudo, mimetype, largura, altura, versao):
+        self.tamanho = tamanho
+        self.conteudo = conteudo
+        self.mimetype = mimetype
+        self.largura = largura
+        self.altura = altura
+        self.versao = versao
+
+
+def _abrir(dados):
+    try:
+        imagem = Image.open(io.BytesIO(dados))
+        if imagem.width * imagem.height > MAX_PIXELS_ENTRADA:
+            raise ImagemInvalida("imagem grande demais")
+        imagem.load()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as exc:
+        raise ImagemInvalida(str(exc)) from exc
+    # Fotos de celular guardam a rotacao no EXIF; aplica antes de redimensionar.
+    return ImageOps.exif_transpose(imagem)
+
+
+def _tem_transparencia(imagem):
+    if imagem.mode in ("RGBA", "LA"):
+        return imagem.getchannel("A").getextrema()[0] < 255
+    return imagem.mode == "P" and "transparency" in imagem.info
+
+
+def _codificar(imagem, transparente):
+    buffer = io.BytesIO()
+    if transparente:
+        imagem.convert("RGBA").save(buffer, format="PNG", optimize=True)
+        return buffer.getvalue(), "image/png"
+    imagem.convert("RGB").save(buffer, format="JPEG", quality=QUALIDADE_JPEG, optimize=True, progressive=True)
+    return buffer.getvalue(), "image/jpeg"
+
+
+def gerar_variantes(dados, tamanhos):
+    """Decodifica `dados` e devolve uma Variante re-codificada para cada tamanho.
+
+    Imagens com transparencia viram PNG; as demais, JPEG progressivo. Nada e
+    ampliado: uma imagem menor que a caixa mantem o tamanho original. Todas as
+    variantes de um mesmo upload compartilham a versao (md5 do arquivo enviado).
+    """
+    if not dados:
+        raise ImagemInvalida("arquivo vazio")
+    versao = hashlib.md5(dados).hexdigest()
+    original = _abrir(dados)
+    transparente = _tem_transparencia(original)
+
+    variantes = []
+    for tamanho in tamanhos:
+        config = TAMANHOS[tamanho]
+        largura_max, altura_max = config["caixa"]
+        if config["recortar"]:
+            lado = min(largura_max, original.width, original.height)
+            imagem = ImageOps.fit(original, (lado, lado), method=Image.LANCZOS)
+        else:
+            imagem = original.copy()
+            imagem.thumbnail((largura_max, altura_max), Image.LANCZOS)
+        conteudo, mimetype = _codificar(imagem, transparente)
+        variantes.append(Variante(tamanho, conteudo, mimetype, imagem.width, imagem.height, versao))
+    return variantes
@@ -0,0 +1,195 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timezone
+
+
+class _Job:
+    def __init__(self, name, func, interval, jitter, timeout, max_backoff, condition):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.timeout = timeout
+        self.max_backoff = max_backoff if max_backoff is not None else interval * 8
+        self.condition = condition
+
+        self.next_run = 0.0
+        self.running = False
+        self.pending = False
+        self.started_at = None
+        self.timeout_reported = False
+        self.runs = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.timeouts = 0
+        self.skipped = 0
+        self.last_start = None
+        self.last_duration = None
+        self.last_success = None
+        self.last_error = None
+
+
+class Scheduler:
+    """Agendador de tarefas periodicas em background.
+
+    Cada tarefa tem intervalo proprio, jitter (segundos aleatorios somados ao
+    intervalo, para os workers nao baterem juntos), timeout e backoff
+    exponencial em caso de falha (intervalo * 2^falhas, ate `max_backoff`).
+    Uma tarefa nunca roda sobreposta a si mesma. `condition` (opcional) decide
+    se a tarefa roda neste processo, por exemplo so no lider; quando ela
+    recusa, a tarefa e reavaliada em ate `idle_recheck` segundos.
+
+    Threads nao podem ser interrompidas: uma execucao que estoura o timeout e
+    registrada como falha, mas termina normalmente.
+    """
+
+    def __init__(self, context=None, idle_recheck=60.0, name="scheduler"):
+        self.name = name
+        self.idle_recheck = idle_recheck
+        self._context = context or nullcontext
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self._executor = None
+
+    def register(self, name, func, interval, jitter=0.0, timeout=None, max_backoff=None,
+                 condition=None, run_at_start=True):
+        job = _Job(name, func, interval, jitter, timeout, max_backoff, condition)
+        if not run_at_start:
+            job.next_run = time.monotonic() + self._delay(job)
+        with self._lock:
+            self._jobs[name] = job
+        return job
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._executor = ThreadPoolExecutor(
+                max_workers=max(1, len(self._jobs)), thread_name_prefix=f"{self.name}-job"
+            )
+            self._thread = threading.Thread(target=self._dispatch, name=self.name, daemon=True)
+        self._thread.start()
+        return True
+
+    @property
+    def started(self):
+        return self._thread is not None
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def trigger(self, name):
+        """Pede uma execucao imediata; se a tarefa estiver rodando, roda de novo ao terminar."""
+        with self._lock:
+            job = self._jobs[name]
+            if job.running:
+                job.pending = True
+            else:
+                job.next_run = 0.0
+        self._wake.set()
+
+    def stats(self):
+        agora = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "nome": job.name,
+                    "intervalo": job.interval,
+                    "rodando": job.running,
+                    "execucoes": job.runs,
+                    "falhas": job.failures,
+                    "falhas_seguidas": job.consecutive_failures,
+                    "timeouts": job.timeouts,
+                    "ignoradas": job.skipped,
+                    "ultimo_inicio": job.last_start.isoformat() if job.last_start else None,
+                    "ultima_duracao": round(job.last_duration, 3) if job.last_duration is not None else None,
+                    "ultimo_sucesso": job.last_success.isoformat() if job.last_success else None,
+                    "ultimo_erro": job.last_error,
+                    "proxima_em": None if job.running else round(max(0.0, job.next_run - agora), 1),
+                }
+                for job in self._jobs.values()
+            ]
+
+    def _delay(self, job):
+        if job.consecutive_failures:
+            base = min(job.interval * (2 ** job.consecutive_failures), job.max_backoff)
+        else:
+            base = job.interval
+        return base + (random.uniform(0, job.jitter) if job.jitter else 0.0)
+
+    def _dispatch(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            agora = time.monotonic()
+            espera = self.idle_recheck
+            with self._lock:
+                for job in self._jobs.values():
+                    if job.running:
+                        self._check_timeout(job, agora)
+                        if job.timeout and not job.timeout_reported:
+                            espera = min(espera, job.started_at + job.timeout - agora)
+                        continue
+                    if agora >= job.next_run:
+                        job.running = True
+                        job.started_at = agora
+                        job.timeout_reported = False
+                        self._executor.submit(self._run, job)
+                    else:
+                        espera = min(espera, job.next_run - agora)
+            self._wake.wait(max(0.05, espera))
+
+    def _check_timeout(self, job, agora):
+        # Chamado com o lock.
+        if job.timeout and not job.timeout_reported and agora - job.started_at > job.timeout:
+            job.timeout_reported = True
+            job.timeouts += 1
+            print(f"⚠️ [{self.name}] {job.name} passou do timeout de {job.timeout:.0f}s")
+
+    def _run(self, job):
+        inicio = time.monotonic()
+        iniciado_em = datetime.now(timezone.utc).replace(microsecond=0)
+        erro = None
+        executou = True
+        try:
+            if job.condition is not None and not job.condition():
+                executou = False
+            else:
+                with self._context():
+                    job.func()
+        except Exception as exc:
+            erro = exc
+        duracao = time.monotonic() - inicio
+
+        with self._lock:
+            job.running = False
+            if not executou:
+                job.skipped += 1
+                job.next_run = time.monotonic() + min(job.interval, self.idle_recheck)
+            else:
+                job.runs += 1
+                job.last_start = iniciado_em
+                job.last_duration = duracao
+                if erro is None and job.timeout and duracao > job.timeout:
+                    erro = TimeoutError(f"demorou {duracao:.0f}s")
+                if erro is None:
+                    job.consecutive_failures = 0
+                    job.last_success = job.last_start
+                    job.last_error = None
+                else:
+                    job.failures += 1
+                    job.consecutive_failures += 1
+                    job.last_error = str(erro)
+                job.next_run = time.monotonic() + self._delay(job)
+            if job.pending:
+                job.pending = False
+                job.next_run = 0.0
+        if erro is not None:
+            print(f"⚠️ [{self.name}] {job.name} falhou ({job.consecutive_failures}x seguidas): {erro}")
+        self._wake.set()